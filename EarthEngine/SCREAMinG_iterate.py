@@ -6,36 +6,33 @@ Created on Wed May 13 12:13:13 2020
 Ted Langhorst
 tlang@live.unc.edu
 
+Usage: python SCREAMinG_iterate.py --yr1 2001 --dt 18 --max-active 4
+Planning (--plan-only) works offline from the local SWORD cache, Earth Engine
+is only initialized once the first export is built (or, with --max-graph-nodes/
+--max-graph-bytes, to size the batch request graphs while planning). The SWORD
+cache itself is built from Earth Engine by the first full run.
+
 """
 
-import ee
-import time
+import os
+import argparse
 import numpy as np
-ee.Initialize()  
-
-pixMap = ee.Image("users/tedlanghorst/SWORD_pixmap_v09")
-
-allReaches = (ee.FeatureCollection('users/tedlanghorst/SWORD_reach_v09')
-             .filterMetadata('width','greater_than',150)
-             .aggregate_array('reach_id').getInfo())
-
-riverReachFilter = filter(lambda r: r%10==1, allReaches)
-reachList = list(riverReachFilter)
 
+import functions_swordCache as fsc
+import functions_tasking as ft
+import functions_batching as fb
+import functions_journal as fj
+import functions_metrics as fm
+import functions_eeCache as fec
+from functions_context import ctx
+from functions_watermask import filterSword
+from functions_migration import calcMigration, calcMigrationSeries
+from functions_nodeSummary import calcStats, calcStatsSeries
 
 #reach limits and step
 RStart = 10000000000
 REnd = 100000000000
 dR = 1000000000
-reachBounds = range(RStart,REnd+1,dR)
-
-def groupFilt(reach):
-  return reach>=RStart and reach<=REnd
-
-allReaches = list(filter(groupFilt, reachList))
-groupList = np.unique([r // dR for r in allReaches])
-reachBounds = [r * dR for r in groupList]
-len(reachBounds)
 
 #settings
 YR1 = 2001
@@ -45,56 +42,175 @@ WIDTH_BUFF = 2
 SCALE = 30
 CRS = "epsg:4326"
 
-
-import functions_tasking as ft
-from functions_watermask import filterSword
-from functions_migration import calcMigration
-from functions_nodeSummary import calcStats
-
-
-def SCREAMinG(reachList_internal):
-  def reachCalcs(reach):
-    #make watermask from JRC dataset
-    swordClip = filterSword(reach,reach, WIDTH_BUFF)
-    #migration raster data
-    mData = calcMigration(YR1, DT, AVG_WINDOW, swordClip, SCALE, CRS)
-    #calculate node-level data
-    reachStats = calcStats(mData, pixMap, swordClip)
-    return reachStats
-  
-  swordStats = ee.FeatureCollection(ee.List(reachList_internal).map(reachCalcs)).flatten()
+SWORD_VERSION = 'v09'
+FOLDER = "SCREAMING_uncertainty_Pickens_noAvg_08042021_v09"
+MAX_ACTIVE = 4    #exports kept running at once
+
+
+#river reaches (width > 150, type 1) in [RStart, REnd] -> (n_nodes, buffer width, reach_len).
+#the buffer width is the mean node width filterSword buffers the ROI by.
+def selectReaches(swordCache, RStart, REnd):
+  reachIds = swordCache.reach('id')
+  isRiver = ((swordCache.reach('width') > 150) & (reachIds % 10 == 1)
+             & (reachIds >= RStart) & (reachIds <= REnd))
+  return {int(r): (n, swordCache.width(r), l) for r, n, l in zip(
+    reachIds[isRiver], swordCache.reach('nNodes')[isRiver], swordCache.reach('len')[isRiver])}
+
+
+#everything that shapes the batches or their results, stored with the manifest
+def planSettings(args):
+  return {'RStart': args.RStart, 'REnd': args.REnd, 'dR': args.dR,
+          'nBatches': args.nBatches, 'maxReaches': args.maxReaches,
+          'maxGraphNodes': args.maxGraphNodes, 'maxGraphBytes': args.maxGraphBytes,
+          'YR1': args.YR1, 'YR1_LAST': args.yr1Last, 'DT': args.DT,
+          'AVG_WINDOW': args.AVG_WINDOW, 'WIDTH_BUFF': args.WIDTH_BUFF,
+          'SCALE': args.SCALE, 'CRS': args.CRS, 'SWORD_VERSION': args.swordVersion}
+
+
+#batches from the manifest if there is one, otherwise plan and save them.
+#a manifest planned with other settings is an error: its journal would skip
+#batches whose exports were made with those settings.
+def planJobs(swordCache, args):
+  settings = planSettings(args)
+  if os.path.exists(args.manifest):
+    jobs, stored = fb.readManifest(args.manifest)
+    changed = fb.settingsMismatch(stored, settings)
+    if changed:
+      diff = ", ".join("{0} {1!r} -> {2!r}".format(k, stored.get(k), settings.get(k)) for k in changed)
+      raise ValueError("{0} was planned with other settings ({1}); remove it and its journal "
+                       "or pass --manifest/--journal for a new run".format(args.manifest, diff))
+    return jobs
+
+  reachAttrs = selectReaches(swordCache, args.RStart, args.REnd)
+  allReaches = list(reachAttrs)
+  #same number of exports as fixed dR ranges unless asked otherwise, balanced by cost
+  nBatches = args.nBatches or len(np.unique([r // args.dR for r in allReaches]))
+
+  attrs = np.array([reachAttrs[r] for r in allReaches], dtype=float).reshape(-1,3)
+  costs = fb.reachCost(attrs[:,0], attrs[:,1], attrs[:,2], args.WIDTH_BUFF, args.SCALE)
+  batches = fb.planBatches(allReaches, costs, nBatches, args.maxReaches)
+  if args.maxGraphNodes or args.maxGraphBytes:
+    #serialize every batch's request graph and split the ones that are too large
+    import functions_graph as fg
+    measure = fg.unrolledMeasure(lambda reach: reachStats(reach, swordCache.width(reach), args))
+    batches, report = fg.limitGraphSize(batches, measure, args.maxGraphNodes, args.maxGraphBytes)
+    fg.printReport(report)
+  jobs = fb.describeBatches(batches, args.YR1, args.DT, args.AVG_WINDOW, args.yr1Last)
+  fb.writeManifest(args.manifest, jobs, settings)
+  return jobs
+
+
+#node table of one reach; reach and width are numbers, or ee objects inside a map
+def reachStats(reach, width, args):
+  #make watermask from JRC dataset
+  swordClip = filterSword(reach,reach, args.WIDTH_BUFF, width)
+  if args.yr1Last is not None:
+    #sliding epochs share their water masks, one table per reach covering all of them
+    pairs = [(yr1, yr1+args.DT) for yr1 in range(args.YR1, args.yr1Last+1)]
+    series = calcMigrationSeries(pairs, args.AVG_WINDOW, swordClip, args.SCALE, args.CRS)
+    return calcStatsSeries(series, ctx.pixMap, swordClip)
+  #migration raster data
+  mData = calcMigration(args.YR1, args.DT, args.AVG_WINDOW, swordClip, args.SCALE, args.CRS)
+  #calculate node-level data
+  return calcStats(mData, ctx.pixMap, swordClip)
+
+
+def SCREAMinG(reachList_internal, swordCache, args):
+  ee = ctx.initialize()
+
+  def reachCalcs(reachWidth):
+    return reachStats(ee.List(reachWidth).get(0), ee.List(reachWidth).get(1), args)
+
+  #cached widths ride along with the ids, so filterSword does not rescan the nodes
+  reachWidths = [[r, swordCache.width(r)] for r in reachList_internal]
+  swordStats = ee.FeatureCollection(ee.List(reachWidths).map(reachCalcs)).flatten()
   return swordStats
 
 
-"""
-single map
-"""
-def inRange(reach):
-  return reach>=R1 and reach<=R2
-
-for idx in range(len(reachBounds)):
-  R1 = reachBounds[idx]
-  R2 = R1 + dR
-  
-  reachListFilt = list(filter(inRange, reachList))
-  
-  # reachListFilt = reachListFilt[0:150]
-  
-  if len(reachListFilt)==0:
-    # print('no reaches in range {0}:{1}'.format(R1,R2))
-    continue
-
-  # #the business
-  swordStats = SCREAMinG(reachListFilt)
-  
-  #export
-  exportTask = ee.batch.Export.table.toDrive(
-    collection = swordStats,
-    description = "{0}_{1}_{2}_{3:02}_{4:02}".format(R1,R2,YR1,DT,AVG_WINDOW),
-    folder = "SCREAMING_uncertainty_Pickens_noAvg_08042021_v09",
-    fileFormat = 'CSV')
-  exportTask.start()
-  now = time.localtime()
-  print("{0:02}:{1:02}\t submitting {2} reaches from range {3}:{4}".format(
-    now.tm_hour,now.tm_min,len(reachListFilt),R1,R2))
-  ft.taskMonitor(exportTask, 10)
+def parseArgs(argv=None):
+  p = argparse.ArgumentParser(description="SCREAMinG bank migration exports over SWORD reaches")
+  p.add_argument('--start', dest='RStart', type=int, default=RStart, help="first reach_id")
+  p.add_argument('--end', dest='REnd', type=int, default=REnd, help="last reach_id")
+  p.add_argument('--dR', dest='dR', type=int, default=dR,
+                 help="reach_id step; the number of non-empty steps is the default batch count")
+  p.add_argument('--batches', dest='nBatches', type=int, default=None, help="number of export batches")
+  p.add_argument('--max-reaches', dest='maxReaches', type=int, default=None, help="reaches per batch cap")
+  p.add_argument('--max-graph-nodes', dest='maxGraphNodes', type=int, default=None,
+                 help="split batches whose reaches x per-reach graph nodes is larger (needs Earth Engine)")
+  p.add_argument('--max-graph-bytes', dest='maxGraphBytes', type=int, default=None,
+                 help="split batches whose reaches x per-reach graph bytes is larger (needs Earth Engine)")
+  p.add_argument('--yr1', dest='YR1', type=int, default=YR1)
+  p.add_argument('--dt', dest='DT', type=int, default=DT)
+  p.add_argument('--yr1-last', dest='yr1Last', type=int, default=None,
+                 help="time-series mode: epochs yr1..yr1-last, each paired with +dt")
+  p.add_argument('--avg-window', dest='AVG_WINDOW', type=int, default=AVG_WINDOW)
+  p.add_argument('--width-buff', dest='WIDTH_BUFF', type=float, default=WIDTH_BUFF)
+  p.add_argument('--scale', dest='SCALE', type=float, default=SCALE)
+  p.add_argument('--crs', dest='CRS', default=CRS)
+  p.add_argument('--max-active', dest='maxActive', type=int, default=MAX_ACTIVE,
+                 help="exports kept running at once")
+  p.add_argument('--folder', dest='folder', default=FOLDER, help="Drive folder for the csv exports")
+  p.add_argument('--sword-version', dest='swordVersion', default=SWORD_VERSION)
+  p.add_argument('--cache-dir', dest='cacheDir', default='.', help="where the SWORD cache lives")
+  p.add_argument('--manifest', dest='manifest', default=None, help="batch manifest (json)")
+  p.add_argument('--journal', dest='journal', default=None, help="run journal (jsonl)")
+  p.add_argument('--metrics', dest='metrics', default=None, help="per-task metrics (jsonl)")
+  p.add_argument('--ee-cache', dest='eeCache', default=None,
+                 help="directory caching getInfo results (recorded on first use)")
+  p.add_argument('--replay', dest='replay', action='store_true',
+                 help="answer getInfo only from --ee-cache, without network")
+  p.add_argument('--plan-only', dest='planOnly', action='store_true',
+                 help="write the batch manifest and exit without touching Earth Engine "
+                      "(needs the SWORD cache of --sword-version in --cache-dir)")
+  args = p.parse_args(argv)
+  if args.planOnly and not os.path.exists(fsc.cachePath(args.swordVersion, args.cacheDir)):
+    p.error("--plan-only needs the SWORD cache {0}, which is built from Earth Engine; "
+            "run once without --plan-only to build it".format(
+              fsc.cachePath(args.swordVersion, args.cacheDir)))
+
+  base = "{0}_{1}_{2}_{3:02}_{4:02}".format(args.RStart,args.REnd,fb.yr1Tag(args.YR1,args.yr1Last),
+                                           args.DT,args.AVG_WINDOW)
+  if args.manifest is None:
+    args.manifest = base + "_batches.json"
+  if args.journal is None:
+    args.journal = base + "_journal.jsonl"
+  if args.metrics is None:
+    args.metrics = base + "_metrics.jsonl"
+  return args
+
+
+def main(argv=None):
+  args = parseArgs(argv)
+  ctx.swordVersion = args.swordVersion
+  if args.eeCache:
+    ctx.cache = fec.EECache(args.eeCache, replay=args.replay)
+
+  #reach and node metadata from the local SWORD cache, built from the assets on first use
+  swordCache = fsc.SwordCache.load(args.swordVersion, args.cacheDir)
+  jobs = planJobs(swordCache, args)
+  print("{0} batches, {1} reaches -> {2}".format(
+    len(jobs), sum(len(j['reaches']) for j in jobs), args.manifest))
+  if args.planOnly:
+    return
+
+  def buildExport(job):
+    ee = ctx.initialize()
+    #the business
+    swordStats = SCREAMinG(job['reaches'], swordCache, args)
+
+    #export
+    return ee.batch.Export.table.toDrive(
+      collection = swordStats,
+      description = job['description'],
+      folder = args.folder,
+      fileFormat = 'CSV')
+
+  #completed and in-flight batches survive a crash or quota interruption
+  journal = fj.RunJournal(args.journal)
+
+  ft.runExports(jobs, ft.EETaskService(buildExport), args.maxActive, 10, journal,
+                fm.MetricsLog(args.metrics))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmark of the node_id join: the old filter-per-feature pattern against the
+keyed join in functions_nodeSummary_local
+
+Usage: python benchmark_nodeJoin.py [nNodes ...]
+
+"""
+import sys
+import time
+import numpy as np
+import functions_nodeSummary_local as fnl
+
+
+#what the old nodeJoin did: filter all of f2 for every feature of f1
+def filterJoin(t1, t2):
+  out = {k: np.array(v, dtype=float) for k, v in t1.items()}
+  for name in t2:
+    if name not in out:
+      out[name] = np.full(len(t1['node_id']), np.nan)
+  for i, nodeId in enumerate(t1['node_id']):
+    match = np.nonzero(t2['node_id'] == nodeId)[0]
+    if len(match) > 0:
+      for name, col in t2.items():
+        if name != 'node_id':
+          out[name][i] = col[match[0]]
+  return out
+
+
+def makeTables(nNodes, seed=0):
+  rng = np.random.default_rng(seed)
+  ids = 11111000010000 + np.arange(nNodes) * 10 + 1
+  t1 = {'node_id': ids, 'width': rng.uniform(100, 1000, nNodes)}
+  #a summary table covers most but not all nodes, in arbitrary order
+  keep = rng.permutation(nNodes)[:int(nNodes * 0.9)]
+  t2 = {'node_id': ids[keep]}
+  for name in ["ADiff","EDiff","t1_mask","t2_mask","t1_bankLen","t2_bankLen","noisyADiff","noisyEDiff"]:
+    t2[name] = rng.uniform(0, 1e5, len(keep))
+  return t1, t2
+
+
+def timeit(f, *args, repeat=5):
+  best = np.inf
+  for _ in range(repeat):
+    t0 = time.perf_counter()
+    out = f(*args)
+    best = min(best, time.perf_counter() - t0)
+  return best, out
+
+
+def main(sizes):
+  print("{0:>8} {1:>12} {2:>12} {3:>8}".format("nodes", "filter (ms)", "keyed (ms)", "speedup"))
+  for n in sizes:
+    t1, t2 = makeTables(n)
+    tFilter, ref = timeit(filterJoin, t1, t2)
+    tKeyed, out = timeit(fnl.nodeJoin, t1, t2)
+    for name in ref:
+      if not np.array_equal(np.asarray(ref[name], float), np.asarray(out[name], float), equal_nan=True):
+        raise AssertionError("joins disagree on " + name)
+    print("{0:>8} {1:>12.2f} {2:>12.3f} {3:>8.0f}".format(n, tFilter*1e3, tKeyed*1e3, tFilter/tKeyed))
+
+
+if __name__ == "__main__":
+  main([int(a) for a in sys.argv[1:]] or [100, 300, 1000, 3000])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+record/replay check of the getInfo cache (functions_eeCache)
+
+record builds the SWORD cache of a version through Earth Engine (credentials
+needed) with every request recorded into the getInfo cache. replay builds it
+again from that cache alone with all network access blocked, checks that the
+result matches the recorded build and reports the time of both.
+
+Usage: python benchmark_replay.py record <ee cache dir> <sword dir> [version]
+       python benchmark_replay.py replay <ee cache dir> <sword dir> [version]
+
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import numpy as np
+import functions_eeCache as fec
+import functions_swordCache as fsc
+from functions_context import ctx, SWORD_VERSION
+
+
+def _blocked(*args, **kwargs):
+  raise OSError("network access during replay")
+
+
+#no connection can be opened from here on
+def blockNetwork():
+  socket.socket.connect = _blocked
+  socket.create_connection = _blocked
+  socket.getaddrinfo = _blocked
+
+
+def buildTimed(version, cacheDir):
+  t0 = time.perf_counter()
+  fsc.buildCache(version, cacheDir)
+  return time.perf_counter() - t0
+
+
+def record(eeCacheDir, swordDir, version):
+  ctx.cache = fec.EECache(eeCacheDir)
+  t = buildTimed(version, swordDir)
+  print("recorded {0} requests in {1:.1f} s -> {2}".format(
+      ctx.cache.nMisses, t, fsc.cachePath(version, swordDir)))
+
+
+def replay(eeCacheDir, swordDir, version):
+  blockNetwork()
+  ctx.cache = fec.EECache(eeCacheDir, replay=True)
+  with tempfile.TemporaryDirectory() as tmp:
+    t = buildTimed(version, tmp)
+    with np.load(fsc.cachePath(version, tmp)) as out, np.load(fsc.cachePath(version, swordDir)) as ref:
+      if sorted(out.files) != sorted(ref.files):
+        raise AssertionError("replayed cache has other columns")
+      for name in ref.files:
+        a, b = ref[name], out[name]
+        same = (np.array_equal(a, b, equal_nan=True) if a.dtype.kind == 'f'
+                else np.array_equal(a, b))
+        if not same:
+          raise AssertionError("replay disagrees on " + name)
+  print("replayed {0} requests in {1:.2f} s, offline, identical to the recorded build".format(
+      ctx.cache.nHits, t))
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 4 or sys.argv[1] not in ('record', 'replay'):
+    sys.exit(__doc__)
+  version = sys.argv[4] if len(sys.argv) > 4 else SWORD_VERSION
+  os.makedirs(sys.argv[3], exist_ok=True)
+  {'record': record, 'replay': replay}[sys.argv[1]](sys.argv[2], sys.argv[3], version)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmark of the local engines on synthetic meandering channels with a known
+migration between the two epochs
+
+The t2 channel is the t1 channel moved `shift` pixels across the valley, so
+every column loses and gains exactly `shift` pixels of water and the bank moves
+shift * cos(slope) along its normal. Every stage is timed (best of `repeat`)
+and its peak traced memory reported, then the node statistics are checked
+against the truth.
+
+Usage: python benchmark_synthetic.py [width ...]
+
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import functions_watermask_local as fwl
+import functions_migration_local as fml
+import functions_nodeSummary_local as fnl
+
+SCALE = 30
+DT = 10
+SHIFT = 3           #pixels the channel moves between the epochs
+CHANNEL = 30        #channel width in pixels
+NODE_LEN = 20       #columns per node
+N_YEARS = 3         #yearly masks per epoch for the noise stage
+RATE_TOL = 0.1      #allowed median relative error of the recovered rates
+
+
+#centre line, t1/t2 masks (float 0/1) and the node pixel map of a width x width/2 raster
+def makeChannel(width, shift=SHIFT, channel=CHANNEL):
+  H = width // 2
+  y = np.arange(H, dtype=np.float64)[:, None]
+  x = np.arange(width, dtype=np.float64)[None, :]
+  amplitude, wavelength = H / 6, width / 1.5
+  centre = H / 2 + amplitude * np.sin(2 * np.pi * x / wavelength)
+  slope = amplitude * 2 * np.pi / wavelength * np.cos(2 * np.pi * x[0] / wavelength)
+
+  m1 = (np.abs(y - centre) < channel / 2).astype(np.float32)
+  m2 = (np.abs(y - centre - shift) < channel / 2).astype(np.float32)
+  pixMap = np.where(np.abs(y - centre - shift / 2) < channel,
+                    11111000010001 + (x // NODE_LEN) * 10, 0).astype(np.int64)
+  return m1, m2, pixMap, slope
+
+
+#per-node truth: changed area, and the bank rate averaged over both banks of the node
+#(one bank moves shift * cos(slope), the other one does not move in that direction)
+def truth(pixMap, slope, shift=SHIFT):
+  ids = np.unique(pixMap[pixMap > 0])
+  cols = np.array([np.count_nonzero((pixMap == i).any(axis=0)) for i in ids])
+  nodeSlope = np.array([slope[(pixMap == i).any(axis=0)].mean() for i in ids])
+  area = shift * cols * SCALE**2
+  rate = shift * SCALE * np.cos(np.arctan(nodeSlope)) / DT / 2
+  return ids, {'ADiff': area, 'EDiff': area, 'ARate': rate, 'ERate': rate}
+
+
+def waterMask(mask, year):
+  wm = fwl.bankCalcs(mask)
+  wm.update(watermask=mask, noisyRiverMask=mask, noisyWaterMask=mask, year=year)
+  return wm
+
+
+def timeit(f, *args, repeat=3):
+  best = np.inf
+  for _ in range(repeat):
+    t0 = time.perf_counter()
+    out = f(*args)
+    best = min(best, time.perf_counter() - t0)
+  tracemalloc.start()
+  f(*args)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return best, peak, out
+
+
+#(name, seconds, peak bytes) per stage and the node table
+def runStages(m1, m2, pixMap, ids, repeat=3):
+  stack = np.stack([m1 > 0] * N_YEARS)
+  stages = [
+    ('bankCalcs', lambda: (waterMask(m1, 2000), waterMask(m2, 2000 + DT))),
+    ('addNoise', lambda: fwl.addNoise_distance(stack, fwl.pickensOErr, fwl.pickensCErr, range(N_YEARS))),
+    ('calcMigration', lambda: fml.calcMigration(wm1, wm2, SCALE)),
+    ('calcStats', lambda: fnl.calcStats(mData, pixMap, ids))]
+
+  timings = []
+  for name, f in stages:
+    seconds, peak, out = timeit(f, repeat=repeat)
+    timings.append((name, seconds, peak))
+    if name == 'bankCalcs':
+      wm1, wm2 = out
+    elif name == 'calcMigration':
+      mData = out
+    elif name == 'calcStats':
+      table = out
+  return timings, table
+
+
+#median relative error per checked column
+def checkTruth(table, ids, expected):
+  assert np.array_equal(table['node_id'], ids)
+  #the first and last node are cut by the raster edge
+  inner = slice(1, -1)
+  return {name: float(np.median(np.abs(table[name][inner] / value[inner] - 1)))
+          for name, value in expected.items()}
+
+
+def main(widths):
+  failed = False
+  for width in widths:
+    m1, m2, pixMap, slope = makeChannel(width)
+    ids, expected = truth(pixMap, slope)
+    timings, table = runStages(m1, m2, pixMap, ids)
+
+    print("{0} x {1} px, {2} nodes".format(m1.shape[1], m1.shape[0], len(ids)))
+    print("  {0:<14} {1:>10} {2:>10} {3:>10}".format("stage", "time (ms)", "Mpx/s", "peak (MB)"))
+    for name, seconds, peak in timings:
+      print("  {0:<14} {1:>10.1f} {2:>10.2f} {3:>10.1f}".format(
+        name, seconds*1e3, m1.size / seconds / 1e6, peak / 1e6))
+
+    errors = checkTruth(table, ids, expected)
+    for name, err in errors.items():
+      ok = err <= RATE_TOL if name.endswith('Rate') else err < 1e-6
+      failed |= not ok
+      print("  {0:<14} median rel. error {1:.4f} {2}".format(name, err, "ok" if ok else "FAIL"))
+
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main([int(a) for a in sys.argv[1:]] or [256, 512, 1024])
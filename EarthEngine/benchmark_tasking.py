@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmark of the export scheduler (functions_tasking.runExports) on the
+FakeTaskService virtual clock
+
+Checks that no more than maxActive exports are ever running, reports the
+throughput against one export at a time, counts the task list calls of the
+backed-off TaskCache against fixed-rate polling, and resumes a run from a
+journal: completed jobs are skipped, jobs still running are polled again
+instead of being resubmitted, failed and lost jobs (also ones that failed while
+the driver was down) are submitted again.
+
+Usage: python benchmark_tasking.py [nJobs [maxActive]]
+
+"""
+import io
+import os
+import sys
+import tempfile
+import contextlib
+import functions_tasking as ft
+import functions_journal as fj
+
+JOB_TIME = 600      #seconds of export per reach
+QUEUE_TIME = 30     #seconds every export waits in READY
+WAITING_PERIOD = 10
+
+
+#FakeTaskService that also tracks the largest number of exports running at once
+class SlotCounter(ft.FakeTaskService):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.maxActive = 0
+    self.failed = set()
+
+  def submit(self, job):
+    taskId = super().submit(job)
+    nActive = sum(self.status(t)['state'] in ft.ACTIVE_STATES for t in self.tasks)
+    self.maxActive = max(self.maxActive, nActive)
+    return taskId
+
+  #tasks in failed report FAILED whatever their clock says
+  def status(self, taskId):
+    status = super().status(taskId)
+    if taskId in self.failed:
+      status['state'] = 'FAILED'
+    return status
+
+  def submitted(self, description):
+    return sum(t['description'] == description for t in self.tasks.values())
+
+
+def makeJobs(nJobs):
+  return [{'description': 'job{0:03}'.format(i), 'reaches': list(range(i + 1))} for i in range(nJobs)]
+
+
+def runtime(job):
+  return JOB_TIME * len(job['reaches'])
+
+
+#runExports without its progress lines
+def quietRun(*args, **kwargs):
+  with contextlib.redirect_stdout(io.StringIO()):
+    return ft.runExports(*args, **kwargs)
+
+
+#(service, records) of one scheduled run
+def schedule(jobs, maxActive, maxPeriod=300, journal=None):
+  service = SlotCounter(runtime, QUEUE_TIME)
+  records = quietRun(jobs, service, maxActive, WAITING_PERIOD, journal, maxPeriod=maxPeriod)
+  if service.maxActive > maxActive:
+    raise AssertionError("{0} exports running with {1} slots".format(service.maxActive, maxActive))
+  if sorted(r['description'] for r in records) != sorted(j['description'] for j in jobs):
+    raise AssertionError("not every job finished exactly once")
+  return service, records
+
+
+def throughput(jobs, maxActive):
+  print("{0:>8} {1:>10} {2:>12} {3:>11} {4:>11}".format("slots", "hours", "reaches/h", "list calls", "max active"))
+  nReaches = sum(len(j['reaches']) for j in jobs)
+  for slots in (1, maxActive):
+    service, _ = schedule(jobs, slots)
+    hours = service.now / 3600
+    print("{0:>8} {1:>10.2f} {2:>12.1f} {3:>11} {4:>11}".format(
+      slots, hours, nReaches / hours, service.nListCalls, service.maxActive))
+
+
+def listCalls(jobs, maxActive):
+  backoff, _ = schedule(jobs, maxActive)
+  fixed, _ = schedule(jobs, maxActive, maxPeriod=WAITING_PERIOD)
+  print("list calls: {0} with backoff, {1} polling every {2} s ({3:.2f} h vs {4:.2f} h)".format(
+    backoff.nListCalls, fixed.nListCalls, WAITING_PERIOD, backoff.now / 3600, fixed.now / 3600))
+
+
+#journal of an interrupted run: job 0 completed, job 1 still running, job 2 failed,
+#job 3 submitted but its task is gone, job 4 submitted and failed while the driver
+#was down; the rest were never started
+def resume(jobs, maxActive):
+  with tempfile.TemporaryDirectory() as tmp:
+    journal = fj.RunJournal(os.path.join(tmp, 'journal.jsonl'))
+    service = SlotCounter(runtime, QUEUE_TIME)
+    journal.record(jobs[0], 'COMPLETED', 'OLD0', runtime(jobs[0]))
+    running = service.submit(jobs[1])
+    journal.record(jobs[1], 'SUBMITTED', running)
+    journal.record(jobs[2], 'FAILED', 'OLD2', 60)
+    journal.record(jobs[3], 'SUBMITTED', 'LOST3')
+    failing = service.submit(jobs[4])
+    journal.record(jobs[4], 'SUBMITTED', failing)
+    service.failed.add(failing)
+    service.sleep(QUEUE_TIME + 1)
+
+    records = quietRun(jobs, service, maxActive, WAITING_PERIOD, fj.RunJournal(journal.path))
+    finished = {r['description']: r for r in records}
+    if jobs[0]['description'] in finished or service.submitted(jobs[0]['description']):
+      raise AssertionError("completed job was run again")
+    if service.submitted(jobs[1]['description']) != 1 or finished[jobs[1]['description']]['taskId'] != running:
+      raise AssertionError("running job was not re-attached")
+    for job in jobs[2:4] + jobs[5:]:
+      if service.submitted(job['description']) != 1:
+        raise AssertionError(job['description'] + " was not submitted once")
+    if service.submitted(jobs[4]['description']) != 2 or finished[jobs[4]['description']]['state'] != 'COMPLETED':
+      raise AssertionError("job that failed while the driver was down was not resubmitted")
+    if len(finished) != len(jobs) - 1:
+      raise AssertionError("resumed run did not finish every remaining job")
+    if fj.RunJournal(journal.path).completed() != {j['description'] for j in jobs}:
+      raise AssertionError("journal does not show every job completed")
+  print("resume: 1 completed skipped, 1 running re-attached, 1 failed, 1 lost and 1 failed "
+        "while down resubmitted, {0} submitted fresh".format(len(jobs) - 5))
+
+
+def main(nJobs, maxActive):
+  jobs = makeJobs(nJobs)
+  throughput(jobs, maxActive)
+  listCalls(jobs, maxActive)
+  resume(jobs, maxActive)
+
+
+if __name__ == "__main__":
+  nJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  maxActive = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+  main(max(nJobs, 5), maxActive)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+functions for splitting reaches into export batches of similar cost
+
+"""
+import json
+import numpy as np
+
+#export description (and csv file name) of one batch
+DESCRIPTION = "{R1}_{R2}_{YR1}_{DT:02}_{AVG_WINDOW:02}"
+#YR1 part of the names of a time-series run (epochs YR1..YR1_LAST), so its exports,
+#manifest and journal never collide with a single-epoch run of the same YR1
+SERIES_YR1 = "{YR1}to{YR1_LAST}"
+
+MANIFEST_VERSION = 1
+
+
+#predicted cost of one reach in pixel-equivalents.
+#the ROI is the reach's nodes buffered by width*WIDTH_BUFF (see filterSword), roughly
+#a strip of reach_len x 2*buffer with round ends. width is the buffer width filterSword
+#uses: the mean node width with missing widths as 500 m (SwordCache.width). Per-node
+#work (grouping and joins) is charged nodeWeight pixels per node.
+def reachCost(nNodes, width, reachLen, WIDTH_BUFF, SCALE, nodeWeight=100):
+  buff = np.asarray(width, dtype=float) * WIDTH_BUFF
+  area = np.asarray(reachLen, dtype=float) * 2 * buff + np.pi * buff**2
+  return area / SCALE**2 + nodeWeight * np.asarray(nNodes, dtype=float)
+
+
+#cut the reaches, in reach_id order, into nBatches runs of roughly equal cost.
+#runs stay contiguous so neighbouring reaches share imagery tiles and every batch
+#is still described by its first and last reach id. Batches with more than
+#maxReaches reaches are split evenly.
+def planBatches(reachIds, costs, nBatches, maxReaches=None):
+  reachIds = np.asarray(reachIds)
+  costs = np.asarray(costs, dtype=float)
+  order = np.argsort(reachIds, kind='stable')
+  reachIds = reachIds[order]
+  costs = costs[order]
+  if len(reachIds) == 0:
+    return []
+
+  nBatches = max(1, min(int(nBatches), len(reachIds)))
+  target = costs.sum() / nBatches
+  #a reach goes to the batch its cost midpoint falls into
+  mid = np.cumsum(costs) - costs / 2
+  idx = np.minimum((mid // target).astype(int), nBatches - 1) if target > 0 else np.zeros(len(costs), int)
+
+  batches = []
+  for b in np.unique(idx):
+    sel = idx == b
+    ids = reachIds[sel]
+    c = costs[sel]
+    nSplit = 1 if not maxReaches else -(-len(ids) // maxReaches)
+    for part in np.array_split(np.arange(len(ids)), nSplit):
+      batches.append({'R1': int(ids[part[0]]),
+                      'R2': int(ids[part[-1]]),
+                      'reaches': [int(r) for r in ids[part]],
+                      'cost': float(c[part].sum())})
+  return batches
+
+
+#nParts contiguous parts of a batch, its cost shared by reach count
+def splitBatch(batch, nParts):
+  ids = batch['reaches']
+  parts = []
+  for part in np.array_split(np.arange(len(ids)), min(nParts, len(ids))):
+    parts.append({'R1': int(ids[part[0]]),
+                  'R2': int(ids[part[-1]]),
+                  'reaches': [int(ids[i]) for i in part],
+                  'cost': batch.get('cost', 0.0) * len(part) / len(ids)})
+  return parts
+
+
+#YR1 as it appears in the names, SERIES_YR1 for a time-series run
+def yr1Tag(YR1, YR1_LAST=None):
+  if YR1_LAST is None:
+    return str(YR1)
+  return SERIES_YR1.format(YR1=YR1, YR1_LAST=YR1_LAST)
+
+
+#export jobs (see functions_tasking.runExports) for planned batches
+def describeBatches(batches, YR1, DT, AVG_WINDOW, YR1_LAST=None):
+  for batch in batches:
+    batch['description'] = DESCRIPTION.format(R1=batch['R1'], R2=batch['R2'],
+                                              YR1=yr1Tag(YR1, YR1_LAST), DT=DT, AVG_WINDOW=AVG_WINDOW)
+  return batches
+
+
+def writeManifest(path, batches, settings):
+  manifest = {'version': MANIFEST_VERSION,
+              'settings': settings,
+              'batches': batches}
+  with open(path, 'w') as f:
+    json.dump(manifest, f, indent=1)
+
+
+#returns (batches, settings)
+def readManifest(path):
+  with open(path) as f:
+    manifest = json.load(f)
+  if manifest.get('version') != MANIFEST_VERSION:
+    raise ValueError("{0}: unsupported manifest version {1}".format(path, manifest.get('version')))
+  return manifest['batches'], manifest['settings']
+
+
+#keys whose value in a manifest's stored settings differs from settings
+def settingsMismatch(stored, settings):
+  return sorted(k for k in set(stored) | set(settings) if stored.get(k) != settings.get(k))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+lazily initialized Earth Engine context
+
+Nothing here touches Earth Engine until an asset or kernel is first used, so
+the helper modules can be imported (and runs planned) offline.
+
+"""
+from functools import cached_property
+import functions_watermask_local as fwl
+
+SWORD_VERSION = 'v09'
+#placeholder project for offline replay, no request ever reaches it
+REPLAY_PROJECT = 'replay'
+
+
+class EEContext:
+  def __init__(self, swordVersion=SWORD_VERSION):
+    self.swordVersion = swordVersion
+    self.initialized = False
+    #functions_eeCache.EECache answering getInfo requests, set before initialize()
+    self.cache = None
+
+  def initialize(self):
+    import ee
+    if not self.initialized:
+      if self.cache is not None:
+        import functions_eeCache
+        functions_eeCache.install(self.cache)
+      if self.cache is not None and self.cache.replay:
+        #offline: no credentials, the algorithm list and results come from the cache
+        #(install() also stubbed what ee.Initialize would download)
+        ee.Initialize(credentials=None, project=REPLAY_PROJECT)
+      else:
+        ee.Initialize()
+      self.initialized = True
+    return ee
+
+  #assets
+  @cached_property
+  def jrcMetadata(self):
+    return self.initialize().Image("JRC/GSW1_2/Metadata")
+
+  @cached_property
+  def jrcYearly(self):
+    return self.initialize().ImageCollection("JRC/GSW1_2/YearlyHistory")
+
+  @cached_property
+  def jrcMonthly(self):
+    return self.initialize().ImageCollection("JRC/GSW1_2/MonthlyHistory")
+
+  @cached_property
+  def pickensYearly(self):
+    return self.initialize().ImageCollection("projects/glad/water/annual")
+
+  @cached_property
+  def sword(self):
+    return self.initialize().FeatureCollection("users/tedlanghorst/SWORD_node_" + self.swordVersion)
+
+  @cached_property
+  def pixMap(self):
+    return self.initialize().Image("users/tedlanghorst/SWORD_pixmap_" + self.swordVersion)
+
+  #kernels, built from the weights in functions_watermask_local
+  @cached_property
+  def daKernel(self):
+    return self.initialize().Kernel.fixed(3,3,fwl.daWeights)
+
+  @cached_property
+  def directionKernel(self):
+    return self.initialize().Kernel.fixed(3,3,fwl.directionWeights)
+
+  @cached_property
+  def kernelValues(self):
+    return self.initialize().List(fwl.kernelValues)
+
+  @cached_property
+  def aspectKey(self):
+    return self.initialize().List(fwl.aspectKey)
+
+
+#shared by all the Earth Engine helper modules
+ctx = EEContext()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+merge of the per-batch csv exports into a partitioned columnar dataset
+
+Every export {R1}_{R2}_{YR1}_{DT}_{AVG_WINDOW}.csv (functions_batching.DESCRIPTION)
+is read in chunks of rows and split by run parameters and reach-id range:
+
+  root/YR1=2001/DT=18/AVG_WINDOW=00/reaches=<reach_id // dR>/data.npz
+
+Time-series runs name their YR1 part {YR1}to{YR1_LAST} (functions_batching.SERIES_YR1)
+and get partitions of their own, YR1=2001to2010/..., with one row per node and year1.
+
+Chunks are spilled to run files as they come, and each partition is sorted by
+node_id (then year1) once at the end, so memory is bounded by the chunk size and the
+largest partition, not by the number of csv files. Columns are typed (ids as
+int64, SCREAMinG columns in their functions_schema dtype, other numbers as
+float, anything else as text) and the missing values of calcStats become NaN.
+
+Usage: python functions_dataset.py <csv dir> <dataset dir> [dR]
+
+"""
+import os
+import re
+import sys
+import csv
+import glob
+import numpy as np
+import functions_schema as fs
+import functions_batching as fb
+
+#reach-id span of one partition, the driver's default dR
+PARTITION_DR = 1000000000
+CHUNK_ROWS = 100000
+
+#export bookkeeping columns that are not data
+dropColumns = ('system:index', '.geo')
+idColumns = ('node_id', 'reach_id', 'year1', 'year2')
+
+_descriptionRE = re.compile(r'^(\d+)_(\d+)_(\d+)(?:to(\d+))?_(\d+)_(\d+)$')
+
+
+#{R1}_{R2}_{YR1}_{DT}_{AVG_WINDOW}.csv (YR1 possibly {YR1}to{YR1_LAST}) -> dict of
+#the ints, YR1_LAST None for single-epoch runs; None for other names
+def parseDescription(path):
+  match = _descriptionRE.match(os.path.splitext(os.path.basename(path))[0])
+  if match is None:
+    return None
+  return {name: (int(v) if v is not None else None) for name, v in
+          zip(('R1', 'R2', 'YR1', 'YR1_LAST', 'DT', 'AVG_WINDOW'), match.groups())}
+
+
+def partitionDir(root, params, bucket):
+  yr1 = fb.yr1Tag(params['YR1'], params.get('YR1_LAST'))
+  return os.path.join(root, 'YR1={0}'.format(yr1), 'DT={0:02}'.format(params['DT']),
+                      'AVG_WINDOW={0:02}'.format(params['AVG_WINDOW']),
+                      'reaches={0}'.format(bucket))
+
+
+#reach_id of SWORD node ids (CBBBBBRRRRNNNT -> CBBBBBRRRRT)
+def nodeReach(nodeIds):
+  nodeIds = np.asarray(nodeIds, dtype=np.int64)
+  return nodeIds // 10000 * 10 + nodeIds % 10
+
+
+#text column -> typed array: schema columns in their storage dtype (functions_schema,
+#missing values as NaN), other numbers float64, the rest text
+def _typed(name, values):
+  if name in idColumns:
+    return np.array([int(float(v)) for v in values], dtype=fs.dtypes[name])
+  try:
+    col = np.array([float(v) if v != '' else np.nan for v in values], dtype=np.float64)
+  except ValueError:
+    return np.array(values, dtype=str)
+  return fs.storageColumn(name, col)
+
+
+#typed column dicts of at most chunkRows rows each
+def readChunks(path, chunkRows=CHUNK_ROWS):
+  with open(path, newline='') as f:
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+      return
+    keep = [i for i, name in enumerate(header) if name not in dropColumns]
+    rows = []
+    for row in reader:
+      rows.append(row)
+      if len(rows) >= chunkRows:
+        yield {header[i]: _typed(header[i], [r[i] for r in rows]) for i in keep}
+        rows = []
+    if rows:
+      yield {header[i]: _typed(header[i], [r[i] for r in rows]) for i in keep}
+
+
+#streams every csv in csvDir into the dataset under root. Returns the partition directories.
+def mergeExports(csvDir, root, dR=PARTITION_DR, chunkRows=CHUNK_ROWS):
+  nRuns = {}
+  for path in sorted(glob.glob(os.path.join(csvDir, '*.csv'))):
+    params = parseDescription(path)
+    if params is None:
+      continue
+    for chunk in readChunks(path, chunkRows):
+      if 'node_id' not in chunk or len(chunk['node_id']) == 0:
+        continue
+      reaches = chunk['reach_id'] if 'reach_id' in chunk else nodeReach(chunk['node_id'])
+      buckets = reaches // dR
+      for bucket in np.unique(buckets):
+        rows = buckets == bucket
+        part = partitionDir(root, params, int(bucket))
+        os.makedirs(part, exist_ok=True)
+        n = nRuns.get(part, 0)
+        np.savez(os.path.join(part, 'run{0:06}.npz'.format(n)),
+                 **{name: col[rows] for name, col in chunk.items()})
+        nRuns[part] = n + 1
+
+  for part in nRuns:
+    _finalizePartition(part)
+  return sorted(nRuns)
+
+
+#runs of one partition -> one node_id sorted data.npz (merged with an earlier data.npz)
+def _finalizePartition(part):
+  paths = sorted(glob.glob(os.path.join(part, 'run*.npz')))
+  dataPath = os.path.join(part, 'data.npz')
+  if os.path.exists(dataPath):
+    paths.insert(0, dataPath)
+
+  runs = []
+  for p in paths:
+    with np.load(p) as run:
+      runs.append({name: run[name] for name in run.files})
+  names = list(dict.fromkeys(name for run in runs for name in run))
+
+  columns = {}
+  for name in names:
+    parts = []
+    for run in runs:
+      n = len(run['node_id'])
+      if name in run:
+        parts.append(run[name])
+      else:
+        parts.append(np.full(n, np.nan))
+    columns[name] = np.concatenate(parts)
+
+  #node_id (then year1) order; a row merged again replaces the earlier copy
+  keys = [columns['node_id']] + [columns[k] for k in ('year1',) if k in columns]
+  order = np.lexsort([np.arange(len(keys[0]))] + keys[::-1])
+  last = np.ones(len(order), dtype=bool)
+  for key in keys:
+    k = key[order]
+    last[:-1] &= k[:-1] == k[1:]
+  order = order[~np.r_[last[:-1], False]]
+  np.savez(dataPath + '.tmp.npz', **{name: col[order] for name, col in columns.items()})
+  os.replace(dataPath + '.tmp.npz', dataPath)
+  for p in paths:
+    if p != dataPath:
+      os.remove(p)
+
+
+#partition directories under root matching the given parameters (None = any). With
+#YR1_LAST only the time series YR1..YR1_LAST, without it only single-epoch runs of YR1.
+def partitions(root, YR1=None, DT=None, AVG_WINDOW=None, YR1_LAST=None):
+  pattern = os.path.join(root,
+                         'YR1={0}'.format(fb.yr1Tag(YR1, YR1_LAST) if YR1 is not None else '*'),
+                         'DT={0:02}'.format(DT) if DT is not None else 'DT=*',
+                         'AVG_WINDOW={0:02}'.format(AVG_WINDOW) if AVG_WINDOW is not None else 'AVG_WINDOW=*',
+                         'reaches=*')
+  return sorted(glob.glob(pattern))
+
+
+#rows for the given nodes or reaches (all rows without either), only the requested columns.
+#partitions outside the reach range of the ids are never opened.
+def query(root, nodeIds=None, reachIds=None, columns=None, dR=PARTITION_DR,
+          YR1=None, DT=None, AVG_WINDOW=None, YR1_LAST=None):
+  if nodeIds is not None:
+    nodeIds = np.unique(np.asarray(nodeIds, dtype=np.int64))
+    wanted = nodeReach(nodeIds)
+  elif reachIds is not None:
+    wanted = np.unique(np.asarray(reachIds, dtype=np.int64))
+  else:
+    wanted = None
+  buckets = None if wanted is None else set((wanted // dR).tolist())
+
+  results = []
+  for part in partitions(root, YR1, DT, AVG_WINDOW, YR1_LAST):
+    if buckets is not None and int(part.rsplit('=', 1)[1]) not in buckets:
+      continue
+    with np.load(os.path.join(part, 'data.npz')) as data:
+      ids = data['node_id']
+      if nodeIds is not None:
+        #node_id sorted, so every id is one binary-searched run of rows
+        lo = np.searchsorted(ids, nodeIds, 'left')
+        hi = np.searchsorted(ids, nodeIds, 'right')
+        n = hi - lo
+        rows = np.repeat(lo - np.r_[0, np.cumsum(n)[:-1]], n) + np.arange(n.sum())
+      elif reachIds is not None:
+        rows = np.isin(nodeReach(ids), wanted)
+      else:
+        rows = slice(None)
+      names = data.files if columns is None else ['node_id'] + [c for c in columns if c != 'node_id']
+      results.append({name: data[name][rows] for name in names if name in data.files})
+
+  if not results:
+    return {}
+  return {name: np.concatenate([r[name] for r in results if name in r]) for name in results[0]}
+
+
+if __name__ == "__main__":
+  dR = int(sys.argv[3]) if len(sys.argv) > 3 else PARTITION_DR
+  for part in mergeExports(sys.argv[1], sys.argv[2], dR):
+    print(part)
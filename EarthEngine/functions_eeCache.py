@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+content-addressed on-disk cache of Earth Engine getInfo results
+
+Every value computed through ee.data.computeValue (what getInfo calls) is
+stored under the SHA-256 of the serialized expression, so the same request
+is answered from disk next time. The algorithm list fetched by ee.Initialize
+is recorded the same way, which lets replay mode initialize and answer
+recorded requests with no network at all. The least recently used entries
+are evicted once the cache grows past maxBytes.
+
+Used through functions_context: ctx.cache = EECache(...) before the first
+ctx.initialize().
+
+"""
+import os
+import json
+import hashlib
+import tempfile
+
+MAX_BYTES = 512 * 2**20
+
+
+class NotRecorded(LookupError):
+  pass
+
+
+class EECache:
+  def __init__(self, cacheDir, maxBytes=MAX_BYTES, replay=False):
+    self.cacheDir = cacheDir
+    self.maxBytes = maxBytes
+    self.replay = replay
+    self.nHits = 0
+    self.nMisses = 0
+    os.makedirs(cacheDir, exist_ok=True)
+    self.nBytes = sum(os.path.getsize(p) for p in self._entries())
+
+  def _entries(self):
+    for root, _, files in os.walk(self.cacheDir):
+      for name in files:
+        if name.endswith('.json'):
+          yield os.path.join(root, name)
+
+  def _path(self, key):
+    return os.path.join(self.cacheDir, key[:2], key + '.json')
+
+  @staticmethod
+  def key(payload):
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+  #cached value of key, or compute() recorded under it (NotRecorded in replay mode)
+  def get(self, key, compute):
+    path = self._path(key)
+    try:
+      with open(path) as f:
+        value = json.load(f)
+      #the file time is the LRU clock
+      os.utime(path)
+      self.nHits += 1
+      return value
+    except (OSError, ValueError):
+      pass
+
+    if self.replay:
+      raise NotRecorded("no recorded result for request " + key)
+    self.nMisses += 1
+    value = compute()
+    self._put(path, value)
+    return value
+
+  def _put(self, path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+      json.dump(value, f)
+    os.replace(tmp, path)
+    self.nBytes += os.path.getsize(path)
+    if self.nBytes > self.maxBytes:
+      self._evict()
+
+  #oldest entries go until the cache is back under 90% of maxBytes
+  def _evict(self):
+    entries = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in self._entries()))
+    self.nBytes = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if self.nBytes <= 0.9 * self.maxBytes:
+        break
+      os.remove(path)
+      self.nBytes -= size
+
+
+#(module, name) -> original of everything install() replaced
+_originals = {}
+
+
+#replace module.name, keeping the original for uninstall()
+def _patch(module, name, value):
+  _originals.setdefault((module, name), getattr(module, name))
+  setattr(module, name, value)
+
+
+#route ee.data.computeValue and ee.data.getAlgorithms through cache. In replay mode
+#also stub two client internals ee.Initialize would otherwise fetch over the network:
+#the REST client, built from a downloaded discovery document (nothing is sent), and
+#the deprecated-asset catalog (it only feeds warnings).
+def install(cache):
+  import ee
+
+  uninstall()
+  patches = [(ee.data, 'computeValue'), (ee.data, 'getAlgorithms')]
+  if cache.replay:
+    patches += [(ee.data, '_install_cloud_api_resource'), (ee.deprecation, '_FetchDataCatalogStac')]
+  missing = ['{0}.{1}'.format(module.__name__, name) for module, name in patches
+             if not hasattr(module, name)]
+  if missing:
+    raise RuntimeError("earthengine-api {0} has no {1}, which the getInfo cache replaces".format(
+      ee.__version__, ", ".join(missing)))
+
+  computeValue = ee.data.computeValue
+  getAlgorithms = ee.data.getAlgorithms
+
+  def cachedComputeValue(obj):
+    payload = json.dumps(ee.serializer.encode(obj, for_cloud_api=True), sort_keys=True)
+    return cache.get(EECache.key(payload), lambda: computeValue(obj))
+
+  def cachedGetAlgorithms():
+    return cache.get(EECache.key('algorithms ' + ee.__version__), getAlgorithms)
+
+  _patch(ee.data, 'computeValue', cachedComputeValue)
+  _patch(ee.data, 'getAlgorithms', cachedGetAlgorithms)
+  if cache.replay:
+    _patch(ee.data, '_install_cloud_api_resource', lambda: None)
+    _patch(ee.deprecation, '_FetchDataCatalogStac', lambda: {})
+
+
+#puts back everything install() replaced
+def uninstall():
+  for (module, name), original in _originals.items():
+    setattr(module, name, original)
+  _originals.clear()
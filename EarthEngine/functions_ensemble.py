@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local uncertainty ensembles of the noisy water masks
+
+Each realization redraws the observation noise of both epochs with a counter
+based generator keyed on (reach, year, realization), so any realization can be
+recomputed alone and the results do not depend on how many workers ran them.
+Node statistics are folded in realization order into streaming mean/variance
+and P-square quantile estimates, so realizations are never kept in memory.
+
+"""
+import multiprocessing
+import numpy as np
+import functions_watermask_local as fwl
+import functions_nodeSummary_local as fnl
+
+#node statistics each realization produces
+ensembleColumns = ['noisyADiff', 'noisyEDiff']
+
+
+#generator for one (reach, year, realization); Philox is counter based so there is no shared stream
+def realizationRNG(reach, year, realization):
+  key = np.array([int(reach), (int(year) << 32) | int(realization)], dtype=np.uint64)
+  return np.random.Generator(np.random.Philox(key=key))
+
+
+#noisy water masks and the noisy river masks (largest body, closed like pickensMask) of one epoch
+def _noisyMasks(masks, years, reach, realization, inputs):
+  rngs = [realizationRNG(reach, y, realization) for y in years]
+  noisyWater = fwl.addNoise_distance(masks, inputs['OErr'], inputs['CErr'], rngs,
+                                     inputs.get('nObs', 13), inputs.get('scale', 30))
+  noisyRiver = fwl.focalMin(fwl.focalMax(fwl.largestBody(noisyWater))) > 0
+  return noisyWater, noisyRiver
+
+
+#(len(ensembleColumns), nNodes) node sums of one realization.
+#inputs: reach, t1Years/t1Masks and t2Years/t2Masks (boolean yearly masks, (nYears, H, W)),
+#pixMap, nodeIds, OErr, CErr and optionally scale, nObs and noData.
+def realize(inputs, realization):
+  reach = inputs['reach']
+  water1, river1 = _noisyMasks(inputs['t1Masks'], inputs['t1Years'], reach, realization, inputs)
+  water2, river2 = _noisyMasks(inputs['t2Masks'], inputs['t2Years'], reach, realization, inputs)
+
+  pixelArea = inputs.get('scale', 30)**2
+  valid = ~np.asarray(inputs['noData'], dtype=bool) if 'noData' in inputs else True
+  ids, index = fnl.nodeIndex(inputs['pixMap'], inputs['nodeIds'])
+  out = np.empty((len(ensembleColumns), len(ids)))
+  #accretion: noisy river at t1 that is land at t2; erosion the other way round
+  for i, diff in enumerate([river1 & ~water2, river2 & ~water1]):
+    out[i] = fnl._groupSum(np.where(diff & valid, pixelArea, np.nan), index, len(ids))
+  return out
+
+
+#P-square quantile estimate (Jain & Chlamtac 1985) for every element of an array
+class P2Quantile:
+  def __init__(self, p, shape):
+    self.p = p
+    self.count = 0
+    self.first = []
+    self.q = np.zeros((5,) + shape)
+    self.n = np.tile(np.arange(5.0).reshape((5,) + (1,)*len(shape)), (1,) + shape)
+    self.want = np.tile(np.array([0, 2*p, 4*p, 2 + 2*p, 4]).reshape((5,) + (1,)*len(shape)), (1,) + shape)
+    self.dn = np.array([0, p/2, p, (1 + p)/2, 1]).reshape((5,) + (1,)*len(shape))
+
+  def update(self, x):
+    x = np.asarray(x, dtype=np.float64)
+    self.count += 1
+    if self.count <= 5:
+      self.first.append(x)
+      if self.count == 5:
+        self.q = np.sort(np.stack(self.first), axis=0)
+        self.first = []
+      return
+
+    q, n = self.q, self.n
+    #cell k the observation falls into, extremes stretch the outer markers
+    q[0] = np.minimum(q[0], x)
+    q[4] = np.maximum(q[4], x)
+    k = np.clip((x[None] >= q[1:4]).sum(axis=0), 0, 3)
+    n += np.arange(5).reshape((5,) + (1,)*x.ndim) > k[None]
+    self.want += self.dn
+
+    for i in (1, 2, 3):
+      d = self.want[i] - n[i]
+      move = ((d >= 1) & (n[i+1] - n[i] > 1)) | ((d <= -1) & (n[i-1] - n[i] < -1))
+      if not move.any():
+        continue
+      s = np.sign(d)
+      with np.errstate(invalid='ignore', divide='ignore'):
+        parabolic = q[i] + s / (n[i+1] - n[i-1]) * (
+          (n[i] - n[i-1] + s) * (q[i+1] - q[i]) / (n[i+1] - n[i]) +
+          (n[i+1] - n[i] - s) * (q[i] - q[i-1]) / (n[i] - n[i-1]))
+        qs = np.where(s > 0, q[i+1], q[i-1])
+        ns = np.where(s > 0, n[i+1], n[i-1])
+        linear = q[i] + s * (qs - q[i]) / (ns - n[i])
+      ok = (q[i-1] < parabolic) & (parabolic < q[i+1])
+      q[i] = np.where(move, np.where(ok, parabolic, linear), q[i])
+      n[i] = np.where(move, n[i] + s, n[i])
+
+  def value(self):
+    if self.count == 0:
+      return np.full(self.q.shape[1:], np.nan)
+    if self.count < 5:
+      return np.quantile(np.stack(self.first), self.p, axis=0)
+    return self.q[2].copy()
+
+
+#running mean, variance (Welford) and quantiles of same-shaped arrays
+class StreamingStats:
+  def __init__(self, shape, quantiles=(0.05, 0.5, 0.95)):
+    self.count = 0
+    self.mean = np.zeros(shape)
+    self.m2 = np.zeros(shape)
+    self.quantiles = [P2Quantile(p, shape) for p in quantiles]
+
+  def update(self, x):
+    x = np.asarray(x, dtype=np.float64)
+    self.count += 1
+    delta = x - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (x - self.mean)
+    for q in self.quantiles:
+      q.update(x)
+
+  def variance(self):
+    return self.m2 / (self.count - 1) if self.count > 1 else np.full(self.mean.shape, np.nan)
+
+
+_workerInputs = None
+
+def _initWorker(inputs):
+  global _workerInputs
+  _workerInputs = inputs
+
+def _realizeWorker(realization):
+  return realize(_workerInputs, realization)
+
+
+#nRealizations realizations of one reach, reduced to a node table with
+#<column>_mean, <column>_var and <column>_q<percent> for every ensemble column.
+#workers > 1 runs the realizations in a process pool (inputs are sent once per worker);
+#results are folded in realization order either way, so the output is identical.
+def runEnsemble(inputs, nRealizations, quantiles=(0.05, 0.5, 0.95), workers=1, first=0):
+  nodeIds = np.unique(np.asarray(inputs['nodeIds'], dtype=np.int64))
+  stats = StreamingStats((len(ensembleColumns), len(nodeIds)), quantiles)
+  realizations = range(first, first + nRealizations)
+
+  if workers > 1:
+    with multiprocessing.Pool(workers, _initWorker, (inputs,)) as pool:
+      for result in pool.imap(_realizeWorker, realizations, chunksize=max(1, nRealizations // (4*workers))):
+        stats.update(result)
+  else:
+    for r in realizations:
+      stats.update(realize(inputs, r))
+
+  table = {'node_id': nodeIds}
+  variance = stats.variance()
+  for i, name in enumerate(ensembleColumns):
+    table[name + '_mean'] = stats.mean[i]
+    table[name + '_var'] = variance[i]
+    for p, q in zip(quantiles, stats.quantiles):
+      table['{0}_q{1:02.0f}'.format(name, p*100)] = q.value()[i]
+  table['nRealizations'] = np.full(len(nodeIds), stats.count)
+  return table
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+size of the Earth Engine request graph of an export batch, and splitting of
+batches whose graph is too large
+
+The graph is serialized locally the way the client sends it (cloud API
+format, shared subexpressions stored once), so batches can be checked before
+anything is submitted.
+
+"""
+import json
+import ee
+import functions_batching as fb
+
+
+#(node count, payload bytes) of the serialized expression
+def graphSize(eeObject):
+  encoded = ee.serializer.encode(eeObject, for_cloud_api=True)
+  nNodes = len(encoded.get('values', {})) if isinstance(encoded, dict) else 1
+  nBytes = len(json.dumps(encoded, separators=(',', ':')))
+  return nNodes, nBytes
+
+
+#measure for limitGraphSize from reachGraph(reach), the export graph of a single reach.
+#a batch is one ee.List.map over its reaches: the client traces the mapped function once
+#and the reach list is a single constant, so the serialized batch hardly grows with its
+#reach count. The server runs one copy of the per-reach graph per reach, so a batch is
+#measured as its reach count times the unrolled graph of one reach (measured once, the
+#reaches only differ in constants).
+def unrolledMeasure(reachGraph):
+  size = []
+  def measure(reaches):
+    if not size:
+      size.append(graphSize(reachGraph(reaches[0])))
+    nNodes, nBytes = size[0]
+    return nNodes * len(reaches), nBytes * len(reaches)
+  return measure
+
+
+#measure(reaches) -> (node count, payload bytes). Batches over maxNodes or maxBytes
+#are halved (contiguous, so R1/R2 still describe them) until they fit, hold a single
+#reach or halving no longer shrinks what is over the limit. Returns the new batch list
+#and one (R1, R2, nReaches, nNodes, nBytes) row per measured batch.
+def limitGraphSize(batches, measure, maxNodes=None, maxBytes=None):
+  def tooLarge(size):
+    return ((maxNodes is not None and size[0] > maxNodes) or
+            (maxBytes is not None and size[1] > maxBytes))
+
+  def smaller(size, than):
+    return ((maxNodes is None or size[0] < than[0]) and
+            (maxBytes is None or size[1] < than[1]))
+
+  out = []
+  report = []
+  pending = [(batch, measure(batch['reaches'])) for batch in batches][::-1]
+  while pending:
+    batch, size = pending.pop()
+    report.append((batch['R1'], batch['R2'], len(batch['reaches'])) + tuple(size))
+    if tooLarge(size) and len(batch['reaches']) > 1:
+      halves = [(half, measure(half['reaches'])) for half in fb.splitBatch(batch, 2)]
+      if all(smaller(s, size) for _, s in halves):
+        #second half is pushed first so the halves come out in reach order
+        pending.extend(halves[::-1])
+        continue
+    out.append(batch)
+  return out, report
+
+
+def printReport(report):
+  print("{0:>12} {1:>12} {2:>8} {3:>8} {4:>10}".format("R1", "R2", "reaches", "nodes", "bytes"))
+  for row in report:
+    print("{0:>12} {1:>12} {2:>8} {3:>8} {4:>10}".format(*row))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+persistent journal of export batches, so an interrupted run can be resumed
+
+One JSON object per line, appended as batches are submitted and finish.
+The last line for a batch description is its current state.
+
+"""
+import os
+import json
+import time
+
+
+class RunJournal:
+  def __init__(self, path):
+    self.path = path
+    self.batches = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          line = line.strip()
+          if not line:
+            continue
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            #a crash mid-write leaves a partial last line
+            continue
+          self.batches[entry['description']] = entry
+
+  def record(self, job, state, taskId=None, runtime=None):
+    entry = {k: v for k, v in job.items() if k != 'reaches'}
+    entry.update(nReaches=len(job['reaches']), state=state, taskId=taskId,
+                 runtime=runtime, time=time.time())
+    self.batches[job['description']] = entry
+    with open(self.path, 'a') as f:
+      f.write(json.dumps(entry) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+
+  def state(self, description):
+    entry = self.batches.get(description)
+    return entry['state'] if entry else None
+
+  #descriptions of batches that finished successfully
+  def completed(self):
+    return {d for d, e in self.batches.items() if e['state'] == 'COMPLETED'}
+
+  #description -> task id of batches submitted but not seen finishing
+  def inFlight(self):
+    return {d: e['taskId'] for d, e in self.batches.items() if e['state'] == 'SUBMITTED'}
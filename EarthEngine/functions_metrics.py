@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+task and stage metrics, written as JSON lines
+
+Export tasks get one record each when they finish (queue wait, run time,
+final state and EECU seconds where the task status reports them). Local
+stages are timed with stage(), which does nothing until a recorder is
+installed with recordStages().
+
+"""
+import os
+import json
+import time
+from contextlib import contextmanager
+
+
+#appends one JSON object per line
+class MetricsLog:
+  def __init__(self, path):
+    self.path = path
+
+  def write(self, record):
+    with open(self.path, 'a') as f:
+      f.write(json.dumps(record) + '\n')
+
+
+def readMetrics(path):
+  records = []
+  if os.path.exists(path):
+    with open(path) as f:
+      for line in f:
+        line = line.strip()
+        if line:
+          records.append(json.loads(line))
+  return records
+
+
+def _seconds(status, end, start):
+  if status.get(end) is not None and status.get(start) is not None:
+    return (status[end] - status[start]) / 1000
+  return None
+
+
+#metrics of a finished export from its task status (functions_tasking.operationStatus layout)
+def taskMetrics(job, status):
+  eecu = status.get('batch_eecu_usage_seconds', status.get('batchEecuUsageSeconds'))
+  return {'kind': 'task',
+          'description': job['description'],
+          'nReaches': len(job['reaches']),
+          'taskId': status.get('id'),
+          'state': status.get('state'),
+          'queueWait': _seconds(status, 'start_timestamp_ms', 'creation_timestamp_ms'),
+          'runtime': _seconds(status, 'update_timestamp_ms', 'start_timestamp_ms'),
+          'eecu': eecu,
+          'error': status.get('error_message'),
+          'time': time.time()}
+
+
+#collects stage timings, optionally also writing them to a MetricsLog
+class StageTimes:
+  def __init__(self, log=None):
+    self.log = log
+    self.records = []
+
+  def add(self, name, seconds, tags):
+    record = dict(tags, kind='stage', stage=name, seconds=seconds)
+    self.records.append(record)
+    if self.log is not None:
+      self.log.write(record)
+
+  #stage -> (count, total seconds, max seconds)
+  def summary(self):
+    out = {}
+    for r in self.records:
+      n, total, longest = out.get(r['stage'], (0, 0.0, 0.0))
+      out[r['stage']] = (n + 1, total + r['seconds'], max(longest, r['seconds']))
+    return out
+
+
+_recorder = None
+
+#install a StageTimes (or None to stop timing), returns the previous one
+def recordStages(recorder):
+  global _recorder
+  previous, _recorder = _recorder, recorder
+  return previous
+
+
+#times the block when a recorder is installed; tags (e.g. reach=...) go into the record
+@contextmanager
+def stage(name, **tags):
+  if _recorder is None:
+    yield
+    return
+  t0 = time.perf_counter()
+  try:
+    yield
+  finally:
+    _recorder.add(name, time.perf_counter() - t0, tags)
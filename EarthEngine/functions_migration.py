@@ -63,13 +63,33 @@ def calcMigration(yr1, dt, avgWindow, sword_clip, SCALE, CRS):
   # pekel
   # wm1 = fw.pekelMask(yearList.get(0), yearList.get(1), sword_clip)
   # wm2 = fw.pekelMask(yearList.get(2), yearList.get(3), sword_clip)
-  # noDataMask = wm1.select("noData").Or(wm2.select("noData")).clip(roi)
-  # wm1 = wm1.mask(noDataMask.Not())
-  # wm2 = wm2.mask(noDataMask.Not())
   
   #Pickens
   wm1 = fw.pickensMask(yearList.get(0), yearList.get(1), sword_clip)
   wm2 = fw.pickensMask(yearList.get(2), yearList.get(3), sword_clip)
+  
+  return maskMigration(wm1, wm2, roi, SCALE, CRS)
+
+
+#migration for every (yr1, yr2) epoch pair in pairs, from one set of water masks.
+#each averaging window's mask (with its noise, largestBody and bankCalcs) is built
+#once and shared by every pair that uses it, so the graph grows with the years, not the pairs.
+#returns a list of (yr1, yr2, migration image).
+def calcMigrationSeries(pairs, avgWindow, sword_clip, SCALE, CRS):
+  roi = ee.Geometry(sword_clip.get('roi'))
+  
+  masks = {}
+  def windowMask(yr):
+    if yr not in masks:
+      masks[yr] = fw.pickensMask(yr, yr+avgWindow, sword_clip)
+    return masks[yr]
+  
+  return [(yr1, yr2, maskMigration(windowMask(yr1), windowMask(yr2), roi, SCALE, CRS))
+          for yr1, yr2 in pairs]
+
+
+#migration bands between two water masks from pickensMask/pekelMask
+def maskMigration(wm1, wm2, roi, SCALE, CRS):
   noDataMask = wm1.select("noData").Or(wm2.select("noData")).clip(roi)
   wm1 = wm1.mask(noDataMask.Not())
   wm2 = wm2.mask(noDataMask.Not())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local (NumPy) counterparts of the migration functions
+
+Water masks are dicts of 2-D arrays keyed by the Earth Engine band names
+(see functions_watermask_local.bankCalcs). Masked pixels are NaN.
+
+"""
+import numpy as np
+import functions_watermask_local as fwl
+
+#neighbour offsets and their step length in pixels.
+_steps = [(dy, dx, (dy*dy + dx*dx)**0.5)
+          for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+
+
+#multi-source cost distance like ee.Image.cumulativeCost(source, maxDistance, geodeticDistance=False).
+#a step between neighbours costs the mean of their cost values times the step length,
+#NaN cost pixels are impassable. The front is relaxed over all pixels at once and
+#stops when nothing changes, so the number of passes is bounded by the longest path
+#(in steps) shorter than maxDistance. Unreachable pixels are NaN.
+def cumulativeCost(cost, source, maxDistance, scale=30):
+  cost = np.asarray(cost, dtype=np.float64)
+  H, W = cost.shape
+  passable = ~np.isnan(cost)
+
+  c = np.pad(np.where(passable, cost, np.inf), 1, mode='constant', constant_values=np.inf)
+  dist = np.full((H+2, W+2), np.inf)
+  dist[1:H+1, 1:W+1][passable & np.asarray(source, dtype=bool)] = 0
+
+  stepCost = []
+  for dy, dx, length in _steps:
+    neighbour = (slice(1+dy, H+1+dy), slice(1+dx, W+1+dx))
+    stepCost.append((neighbour, (c[1:H+1, 1:W+1] + c[neighbour]) / 2 * length * scale))
+
+  core = dist[1:H+1, 1:W+1]
+  while True:
+    best = core.copy()
+    for neighbour, sc in stepCost:
+      np.minimum(best, dist[neighbour] + sc, out=best)
+    best[best > maxDistance] = np.inf
+    if not (best < core).any():
+      break
+    core[...] = best
+
+  out = core.astype(np.float32)
+  out[np.isinf(out)] = np.nan
+  return out
+
+
+#one pixel per 8-connected component (reduceToVectors' default), at the member pixel nearest the centroid.
+def componentCentres(image):
+  from scipy import ndimage
+
+  labels, n = ndimage.label(image, structure=np.ones((3, 3)))
+  centres = np.zeros(labels.shape, dtype=bool)
+  if n == 0:
+    return centres
+
+  rows, cols = np.nonzero(labels)
+  lab = labels[rows, cols]
+  count = np.bincount(lab, minlength=n+1)
+  cy = np.bincount(lab, rows, minlength=n+1)[lab] / count[lab]
+  cx = np.bincount(lab, cols, minlength=n+1)[lab] / count[lab]
+  d2 = (rows - cy)**2 + (cols - cx)**2
+
+  #nearest pixel per label: sort by label then distance, keep the first of each label.
+  order = np.lexsort((d2, lab))
+  first = order[np.r_[True, lab[order][1:] != lab[order][:-1]]]
+  centres[rows[first], cols[first]] = True
+  return centres
+
+
+#rate calculations, same bands as functions_migration.diffMap: diff, dist, bankRate, noisyDiff.
+#wm1/wm2 need 'mask', 'banks', 'watermask' and 'year'; noisyDiff needs the noisy bands too.
+def diffMap(wm1, wm2, scale=30, pixelArea=None, maxDistance=1000):
+  dt = abs(wm1['year'] - wm2['year'])
+  if pixelArea is None:
+    pixelArea = scale * scale
+
+  #pixels that were water in wm1 and land in wm2.
+  mask1 = np.asarray(wm1['mask'], dtype=np.float32)
+  water2 = np.asarray(wm2['watermask'], dtype=np.float32)
+  diff = (mask1 - water2) == 1
+
+  #calculate distance across the changed area to the old banks.
+  banks1 = ~np.isnan(np.asarray(wm1['banks'], dtype=np.float32))
+  bankDist = cumulativeCost(fwl.focalMax(np.where(diff, 1, np.nan)), banks1, maxDistance, scale)
+  bankDist[~diff] = np.nan
+
+  #changed pixels the bank front never reaches are islands, measure those from their centres instead.
+  islands = diff & np.isnan(bankDist)
+  islandDist = cumulativeCost(fwl.focalMax(np.where(islands, 1, np.nan)),
+                              componentCentres(islands), maxDistance, scale)
+  islandDist[~islands] = np.nan
+
+  dist = np.nan_to_num(bankDist) + np.nan_to_num(islandDist)
+  dist[~diff] = np.nan
+
+  banks2 = np.asarray(wm2['banks'], dtype=np.float32) > 0
+  bankRate = np.where(banks2, np.nan_to_num(dist) / dt, np.nan).astype(np.float32)
+
+  bands = {'diff': np.where(diff, pixelArea, np.nan).astype(np.float32),
+           'dist': dist,
+           'bankRate': bankRate}
+
+  if 'noisyRiverMask' in wm1 and 'noisyWaterMask' in wm2:
+    noisy = (np.asarray(wm1['noisyRiverMask'], dtype=np.float32)
+             - np.asarray(wm2['noisyWaterMask'], dtype=np.float32)) == 1
+    bands['noisyDiff'] = np.where(noisy, pixelArea, np.nan).astype(np.float32)
+
+  return bands
+
+
+#like functions_migration.maskMigration: accretion (A) and erosion (E) bands plus both
+#masks with t1_/t2_ prefixes. noData pixels of either epoch are masked everywhere.
+def calcMigration(wm1, wm2, scale=30, pixelArea=None, maxDistance=1000):
+  if pixelArea is None:
+    pixelArea = scale * scale
+
+  noData = np.zeros(np.shape(wm1['mask']), dtype=bool)
+  for wm in (wm1, wm2):
+    if 'noData' in wm:
+      noData |= np.nan_to_num(np.asarray(wm['noData'], dtype=np.float32)) > 0
+
+  def masked(wm):
+    out = {}
+    for name, band in wm.items():
+      if name == 'year':
+        out[name] = band
+      else:
+        out[name] = np.where(noData, np.nan, np.asarray(band, dtype=np.float32))
+    return out
+
+  wm1 = masked(wm1)
+  wm2 = masked(wm2)
+
+  #errosion and accretion
+  bands = {}
+  for prefix, a, b in (('A', wm1, wm2), ('E', wm2, wm1)):
+    d = diffMap(a, b, scale, pixelArea, maxDistance)
+    bands[prefix + 'Diff'] = d['diff']
+    bands[prefix + 'Dist'] = d['dist']
+    bands[prefix + 'Rate'] = d['bankRate']
+    if 'noisyDiff' in d:
+      bands['noisy' + prefix + 'Diff'] = d['noisyDiff']
+
+  for prefix, wm in (('t1_', wm1), ('t2_', wm2)):
+    for name, band in wm.items():
+      if name != 'year':
+        bands[prefix + name] = band
+    bands[prefix + 'mask'] = wm['mask'] * pixelArea
+
+  bands['year'] = wm1['year']
+  bands['year2'] = wm2['year']
+  return bands
+
+
+#migration for every (yr1, yr2) pair in pairs. maskFor(yr) returns the water mask
+#bands of the window starting at yr; each window is built once and shared by all
+#pairs that use it. Returns a list of (yr1, yr2, migration bands).
+def calcMigrationSeries(pairs, maskFor, scale=30, pixelArea=None, maxDistance=1000):
+  masks = {}
+  def windowMask(yr):
+    if yr not in masks:
+      masks[yr] = maskFor(yr)
+    return masks[yr]
+
+  return [(yr1, yr2, calcMigration(windowMask(yr1), windowMask(yr2), scale, pixelArea, maxDistance))
+          for yr1, yr2 in pairs]
@@ -8,6 +8,7 @@ April 2020
 
 """
 import ee
+import functions_schema as fs
 
 
 def groupReduce(dataImg, pixMap, redux):
@@ -96,89 +97,137 @@ def setConstant(fc, propDict):
   return ee.FeatureCollection(fc).map(internalMap)
 
 
+#keyed join on node_id: one saveFirst join instead of a filter per feature.
+#f1 features get the properties of their f2 match, unmatched ones pass through.
 def nodeJoin(f1,f2):
+  joined = ee.Join.saveFirst(matchKey = "match", outer = True).apply(
+    primary = f1,
+    secondary = f2,
+    condition = ee.Filter.equals(leftField = "node_id", rightField = "node_id"))
+
   def internalMap(fMap):
-    match = f2.filter(ee.Filter.eq("node_id",fMap.get("node_id")))
+    match = fMap.get("match")
+    fMap = fMap.select(fMap.propertyNames().remove("match"))
     fOut = ee.Algorithms.If(
-      condition = match.size().gt(0),
-      trueCase = fMap.copyProperties(match.first()),
+      condition = match,
+      trueCase = fMap.copyProperties(ee.Feature(match)),
       falseCase = fMap)
     return fOut
 
-  return f1.map(internalMap)
-
-def addMissingProperties(feat):
-    nProperties = ee.Number(feat.propertyNames().length())
-    featOut = ee.Algorithms.If(
-                  condition = nProperties.lte(23),
-                  falseCase = feat,
-                  trueCase = feat.set({
-                          'nProperties':nProperties,
-                          'ADiff': -1,
-                          'EDiff': -1,
-                          't1_mask': -1,
-                          't2_mask': -1,
-                          't1_bankLen': -1,
-                          't2_bankLen': -1,
-                          'noisyADiff': -1,
-                          'noisyEDiff': -1,
-                          'ARate': -1,
-                          'ERate': -1,
-                          'ADir': -9999,
-                          'ADirR': -1,
-                          'EDir': -9999,
-                          'EDirR': -1}))
-    return featOut
+  return ee.FeatureCollection(joined).map(internalMap)
+
+#every schema column on every feature: the missing values, overwritten by whatever
+#the feature already has. One dictionary combine, no per-feature conditional.
+def fillMissing(fc):
+  defaults = ee.Dictionary(fs.missingValues)
+  return ee.FeatureCollection(fc).map(lambda f: f.set(defaults.combine(f.toDictionary(), True)))
+
+#bands summed and averaged per node
+sumBands = ["ADiff","EDiff","t1_mask","t2_mask","t1_bankLen","t2_bankLen","noisyADiff","noisyEDiff"]
+meanBands = ["ARate","ERate"]
+
+#all of calcStats' grouped statistics in one reduceRegion.
+#everything is turned into a sum so a single grouped reducer covers it: means are
+#sum/count and the weighted circular means are sum(w*x)/sum(w), sum(w*y)/sum(w).
+#Masked pixels are unmasked to 0 so each band keeps its own mask.
+def fusedGroupReduce(mData, pixMap):
+  sumImg = mData.select(sumBands).unmask(0)
+
+  unweighted = []
+  for b in meanBands:
+    value = mData.select(b)
+    unweighted += [value.unmask(0), value.mask().gt(0).unmask(0)]
+
+  #(aspect band, weight) for EDir and ADir, as in xyWeightedGroupReduce
+  dirInputs = [
+    (mData.select("t1_bankAspect"), mData.select("EDist").mask(mData.select("t1_banks"))),
+    (mData.select("t2_bankAspect"), mData.select("ADist").mask(mData.select("t2_banks")))]
+  for aspect, weights in dirInputs:
+    xy = ang2xy(aspect)
+    unweighted += [xy.select("x").multiply(weights).unmask(0),
+                   xy.select("y").multiply(weights).unmask(0),
+                   weights.updateMask(aspect.mask()).unmask(0)]
+
+  nSum = len(sumBands)
+  nUnweighted = len(unweighted)
+  reducer = (ee.Reducer.sum().repeat(nSum)
+             .combine(ee.Reducer.sum().unweighted().repeat(nUnweighted), "u_", False)
+             .group(groupField = nSum + nUnweighted, groupName = "node_id"))
+
+  unweightedImg = ee.Image.cat(unweighted).rename(["u{0}".format(i) for i in range(nUnweighted)])
+  imgStats = (sumImg.addBands(unweightedImg).addBands(pixMap)
+    .reduceRegion(
+      reducer = reducer,
+      scale = mData.getNumber("SCALE"),
+      crs = mData.getString("CRS"),
+      bestEffort = False,
+      maxPixels = int(1E10),
+      tileScale = 4).get("groups"))
+
+  def ratio(num, den, missing):
+    return ee.Number(ee.Algorithms.If(ee.Number(den).gt(0), ee.Number(num).divide(den), missing))
+
+  def direction(u, i, name):
+    #same outputs and sentinels as xy2ang_fc
+    w = ee.Number(u.get(i+2))
+    mx = ratio(u.get(i), w, 0)
+    my = ratio(u.get(i+1), w, 0)
+    valid = w.gt(0)
+    return ee.Dictionary.fromLists([name, ee.String(name).cat("R")],
+      [ee.Algorithms.If(valid, mx.atan2(my), -9999),
+       ee.Algorithms.If(valid, mx.pow(2).add(my.pow(2)).sqrt(), -1)])
+
+  def unpack(group):
+    group = ee.Dictionary(group)
+    u = ee.List(group.get("u_sum"))
+    props = (ee.Dictionary.fromLists(sumBands, group.get("sum"))
+             .set("ARate", ratio(u.get(0), u.get(1), -1))
+             .set("ERate", ratio(u.get(2), u.get(3), -1))
+             .combine(direction(u, 4, "EDir"))
+             .combine(direction(u, 7, "ADir"))
+             .set("node_id", group.get("node_id")))
+    return ee.Feature(None, props)
+
+  return ee.FeatureCollection(ee.List(imgStats).map(unpack))
 
 #
-def calcStats(mData, pixMap, swordClip):
-  pixMapMask = (pixMap.clip(mData.geometry()) 
-  .eq(ee.Image.constant(swordClip.aggregate_array('node_id')))
-  .reduce(ee.Reducer.anyNonZero()))
-  pixMap = pixMap.updateMask(pixMapMask)
-  
-  #reduce the data in different ways
-  sumData = mData.select(["ADiff","EDiff","t1_mask","t2_mask","t1_bankLen","t2_bankLen","noisyADiff","noisyEDiff"])
-  sumFeat = groupReduce(sumData, pixMap, ee.Reducer.sum())
-  nodeData = nodeJoin(swordClip,sumFeat)
+def calcStats(mData, pixMap, swordClip, fused=True):
+  #keep only the clip's nodes: one remap lookup per pixel instead of a band per node.
+  #remap masks every value that is not in the list.
+  nodeIds = swordClip.aggregate_array('node_id')
+  pixMap = pixMap.clip(mData.geometry()).remap(nodeIds, nodeIds).rename(pixMap.bandNames())
   
-  meanData = mData.select(["ARate","ERate"])
-  meanFeat = groupReduce(meanData, pixMap, ee.Reducer.mean().unweighted())
-  nodeData = nodeJoin(nodeData,meanFeat)
+  if fused:
+    #one grouped pass and one join
+    nodeData = nodeJoin(swordClip, fusedGroupReduce(mData, pixMap))
+  else:
+    #reduce the data in different ways
+    sumData = mData.select(sumBands)
+    sumFeat = groupReduce(sumData, pixMap, ee.Reducer.sum())
+    nodeData = nodeJoin(swordClip,sumFeat)
     
-  EDir = xyWeightedGroupReduce(ang2xy(mData.select("t1_bankAspect")), \
-  mData.select("EDist").mask(mData.select("t1_banks")),pixMap, "EDir")
-  nodeData = nodeJoin(nodeData,EDir)
-   
-  ADir = xyWeightedGroupReduce(ang2xy(mData.select("t2_bankAspect")),
-  mData.select("ADist").mask(mData.select("t2_banks")),pixMap, "ADir")
-  nodeData = nodeJoin(nodeData,ADir)
+    meanData = mData.select(meanBands)
+    meanFeat = groupReduce(meanData, pixMap, ee.Reducer.mean().unweighted())
+    nodeData = nodeJoin(nodeData,meanFeat)
+      
+    EDir = xyWeightedGroupReduce(ang2xy(mData.select("t1_bankAspect")), \
+    mData.select("EDist").mask(mData.select("t1_banks")),pixMap, "EDir")
+    nodeData = nodeJoin(nodeData,EDir)
+     
+    ADir = xyWeightedGroupReduce(ang2xy(mData.select("t2_bankAspect")),
+    mData.select("ADist").mask(mData.select("t2_banks")),pixMap, "ADir")
+    nodeData = nodeJoin(nodeData,ADir)
   
   #add null data to any feature that is missing SCREAMinG data.
-  nodeData = nodeData.map(addMissingProperties)
+  nodeData = fillMissing(nodeData)
   
   dataOut = ee.FeatureCollection(nodeData).copyProperties(mData)
   
   return dataOut
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+#node statistics for every epoch of calcMigrationSeries in one collection,
+#each feature tagged with the epoch's year1/year2.
+def calcStatsSeries(series, pixMap, swordClip, fused=True):
+  epochs = [setConstant(calcStats(mData, pixMap, swordClip, fused), {'year1': yr1, 'year2': yr2})
+            for yr1, yr2, mData in series]
+  return ee.FeatureCollection(epochs).flatten()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local (NumPy) counterparts of the SWORD summary functions
+
+Node tables are dicts of equal-length 1-D arrays, one per property, with a
+'node_id' column. A property a node does not have is NaN.
+
+"""
+import numpy as np
+import functions_schema as fs
+
+
+def nRows(table):
+  return len(table['node_id'])
+
+
+#keyed join on node_id, like functions_nodeSummary.nodeJoin: rows of t1 get the
+#columns of their t2 match (overwriting), unmatched rows keep their values.
+#t2 is sorted once and every t1 id is looked up with a binary search.
+def nodeJoin(t1, t2):
+  ids1 = np.asarray(t1['node_id'])
+  ids2 = np.asarray(t2['node_id'])
+  order = np.argsort(ids2, kind='stable')
+  sorted2 = ids2[order]
+
+  pos = np.searchsorted(sorted2, ids1)
+  pos[pos == len(sorted2)] = 0
+  matched = (sorted2[pos] == ids1) if len(sorted2) else np.zeros(len(ids1), bool)
+  src = order[pos[matched]]
+
+  out = dict(t1)
+  for name, col in t2.items():
+    if name == 'node_id':
+      continue
+    col = np.asarray(col)
+    if name in out:
+      dest = np.array(out[name], dtype=np.result_type(out[name], col))
+    else:
+      dest = np.full(len(ids1), np.nan, dtype=np.result_type(col.dtype, np.float32))
+    dest[matched] = col[src]
+    out[name] = dest
+  return out
+
+
+#bands summed and averaged per node (functions_nodeSummary.sumBands/meanBands)
+sumBands = ["ADiff","EDiff","t1_mask","t2_mask","t1_bankLen","t2_bankLen","noisyADiff","noisyEDiff"]
+meanBands = ["ARate","ERate"]
+
+#values calcStats gives nodes without SCREAMinG data (functions_schema)
+missingValues = fs.missingValues
+
+
+#node of every pixel: (ids, index) with index -1 where the pixel map has no node (0 or NaN).
+#with nodeIds only those nodes are indexed (binary search into the short sorted id list
+#instead of sorting the whole pixel map).
+def nodeIndex(pixMap, nodeIds=None):
+  pixMap = np.asarray(pixMap).ravel()
+  if nodeIds is None:
+    valid = pixMap > 0
+    ids, inverse = np.unique(pixMap[valid], return_inverse=True)
+    index = np.full(pixMap.shape, -1, dtype=np.int64)
+    index[valid] = inverse
+    return ids.astype(np.int64), index
+
+  ids = np.unique(np.asarray(nodeIds, dtype=np.int64))
+  if len(ids) == 0:
+    return ids, np.full(pixMap.shape, -1, dtype=np.int64)
+  index = np.searchsorted(ids, pixMap)
+  index[index == len(ids)] = 0
+  index[ids[index] != pixMap] = -1
+  return ids, index
+
+
+#CSR-style pixel index: (ids, offsets, pixels) with the flat pixel-map positions of
+#node ids[i] in pixels[offsets[i]:offsets[i+1]], in raster order.
+def pixelIndex(pixMap, nodeIds=None):
+  ids, index = nodeIndex(pixMap, nodeIds)
+  counts = np.bincount(index[index >= 0], minlength=len(ids))
+  offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+  np.cumsum(counts, out=offsets[1:])
+  #stable sort of the node index, pixels without a node (-1) end up in front and are cut
+  order = np.argsort(index, kind='stable')
+  pixels = order[len(index) - offsets[-1]:]
+  return ids, offsets, pixels
+
+
+#flat positions of one node's pixels from a pixelIndex (empty for unknown nodes)
+def nodePixels(pixelIdx, nodeId):
+  ids, offsets, pixels = pixelIdx
+  i = np.searchsorted(ids, nodeId)
+  if i == len(ids) or ids[i] != nodeId:
+    return pixels[:0]
+  return pixels[offsets[i]:offsets[i+1]]
+
+
+#per-node sum (and count) of the unmasked (non-NaN) pixels of one band.
+#pixels without a node or value go to an extra bin instead of being compressed out.
+def _groupSum(values, index, nNodes, count=False):
+  values = np.asarray(values, dtype=np.float64).ravel()
+  valid = np.isfinite(values)
+  bins = np.where(valid & (index >= 0), index, nNodes)
+  s = np.bincount(bins, weights=np.where(valid, values, 0), minlength=nNodes+1)[:nNodes]
+  if not count:
+    return s
+  n = np.bincount(bins, minlength=nNodes+1)[:nNodes]
+  return s, n
+
+
+#like functions_nodeSummary.groupReduce with ee.Reducer.sum() or ee.Reducer.mean().unweighted().
+#nodes without a valid pixel in a band get NaN for the mean and 0 for the sum.
+def groupReduce(dataBands, pixMap, redux='sum'):
+  ids, index = nodeIndex(pixMap)
+  table = {'node_id': ids}
+  for name, values in dataBands.items():
+    s, n = _groupSum(values, index, len(ids), count=True)
+    if redux == 'sum':
+      table[name] = s
+    elif redux == 'mean':
+      with np.errstate(invalid='ignore', divide='ignore'):
+        table[name] = np.where(n > 0, s / np.maximum(n, 1), np.nan)
+    else:
+      raise ValueError("redux must be 'sum' or 'mean', not {0!r}".format(redux))
+  return table
+
+
+def ang2xy(image):
+  return np.cos(image), np.sin(image)
+
+
+#mean vector to angle and resultant length, with xy2ang_fc's -9999/-1 where there is no data
+def xy2ang(mx, my, valid):
+  theta = np.where(valid, np.arctan2(mx, my), -9999)
+  R = np.where(valid, np.sqrt(mx**2 + my**2), -1)
+  return theta, R
+
+
+#like functions_nodeSummary.xyWeightedGroupReduce: weighted mean of the unit vectors per node
+def xyWeightedGroupReduce(aspect, weights, pixMap, outName):
+  ids, index = nodeIndex(pixMap)
+  x, y = ang2xy(np.asarray(aspect, dtype=np.float64))
+  weights = np.asarray(weights, dtype=np.float64)
+  w = np.where(np.isnan(x), np.nan, weights)
+  sx = _groupSum(x * weights, index, len(ids))
+  sy = _groupSum(y * weights, index, len(ids))
+  sw = _groupSum(w, index, len(ids))
+  valid = sw > 0
+  with np.errstate(invalid='ignore', divide='ignore'):
+    theta, R = xy2ang(sx / sw, sy / sw, valid)
+  return {'node_id': ids, outName: theta, outName + 'R': R}
+
+
+#(name, aspect band, weight band, bank band) of the two direction statistics
+_dirInputs = [('EDir', 't1_bankAspect', 'EDist', 't1_banks'),
+              ('ADir', 't2_bankAspect', 'ADist', 't2_banks')]
+
+#everything calcStats needs as additive per-node sums (the layout of the fused reducer).
+#sums from different tiles of the same nodes can simply be added before finalizeStats.
+#sum bands mData does not have (the noisy diffs without noisy masks) are left out.
+def statSums(mData, pixMap, nodeIds=None):
+  ids, index = nodeIndex(pixMap, nodeIds)
+  n = len(ids)
+  sums = {}
+  for b in sumBands:
+    if b in mData:
+      sums[b] = _groupSum(mData[b], index, n)
+  for b in meanBands:
+    sums[b], sums[b + '_n'] = _groupSum(mData[b], index, n, count=True)
+  for name, aspectBand, weightBand, bankBand in _dirInputs:
+    x, y = ang2xy(np.asarray(mData[aspectBand], dtype=np.float64))
+    banks = ~np.isnan(np.asarray(mData[bankBand], dtype=np.float64))
+    weights = np.where(banks, np.asarray(mData[weightBand], dtype=np.float64), np.nan)
+    sums[name + '_x'] = _groupSum(x * weights, index, n)
+    sums[name + '_y'] = _groupSum(y * weights, index, n)
+    sums[name + '_w'] = _groupSum(np.where(np.isnan(x), np.nan, weights), index, n)
+  return ids, sums
+
+
+#node table from statSums' sums, without the sum bands that were left out
+#(withMissing gives them the missing value)
+def finalizeStats(ids, sums):
+  table = {'node_id': ids}
+  for b in sumBands:
+    if b in sums:
+      table[b] = sums[b]
+  with np.errstate(invalid='ignore', divide='ignore'):
+    for b in meanBands:
+      table[b] = np.where(sums[b + '_n'] > 0, sums[b] / sums[b + '_n'], missingValues[b])
+    for name, _, _, _ in _dirInputs:
+      w = sums[name + '_w']
+      table[name], table[name + 'R'] = xy2ang(sums[name + '_x'] / w, sums[name + '_y'] / w, w > 0)
+  return table
+
+
+#like functions_nodeSummary.calcStats: statistics for every node in nodeIds,
+#nodes without pixels get the missing values.
+def calcStats(mData, pixMap, nodeIds):
+  nodeIds = np.asarray(nodeIds, dtype=np.int64)
+  return withMissing(nodeIds, finalizeStats(*statSums(mData, pixMap, nodeIds)))
+
+
+#stats joined onto nodeIds, the missing values where a node has none
+def withMissing(nodeIds, stats):
+  nodeData = nodeJoin({'node_id': nodeIds}, stats)
+  for name, value in missingValues.items():
+    col = nodeData.get(name, np.full(len(nodeIds), np.nan))
+    nodeData[name] = np.where(np.isnan(col), value, col)
+  return nodeData
+
+
+#calcStats for every epoch of functions_migration_local.calcMigrationSeries,
+#stacked into one table with year1/year2 columns.
+def calcStatsSeries(series, pixMap, nodeIds):
+  tables = []
+  for yr1, yr2, mData in series:
+    table = calcStats(mData, pixMap, nodeIds)
+    table['year1'] = np.full(nRows(table), yr1)
+    table['year2'] = np.full(nRows(table), yr2)
+    tables.append(table)
+  return {name: np.concatenate([t[name] for t in tables]) for name in tables[0]}
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local SCREAMinG run over many reaches with a process pool
+
+The node pixel map and the epoch rasters stay on disk as .npy files. Workers
+open them as read-only memory maps once (pool initializer), so they share the
+page cache instead of each receiving a pickled copy, and every task only
+carries a reach id and its window. Each reach comes back as its node ids and
+one float32 matrix of the functions_schema data columns, and results are
+written to numbered .npz parts as they arrive.
+
+Usage: python functions_runner.py <config.json> <output dir> [workers] [stage log]
+config: {"pixMap": path, "epoch1": {...}, "epoch2": {...}} with the epochs as
+in functions_tiles (year plus .npy paths of mask, watermask, ...). With a stage
+log every worker appends its filterSword/calcMigration/calcStats timings there as JSON lines
+(functions_metrics).
+
+"""
+import os
+import sys
+import json
+import glob
+import multiprocessing
+import numpy as np
+import functions_schema as fs
+import functions_tiles as ftl
+import functions_migration_local as fml
+import functions_nodeSummary_local as fnl
+import functions_metrics as fm
+import functions_dataset as fd
+
+ROW_CHUNK = 1024    #pixel-map rows read at once while finding the reach windows
+FLUSH_EVERY = 256   #reaches per output part
+
+dataNames = [name for name, _, _ in fs.dataColumns]
+
+
+#reach -> (row0, row1, col0, col1) bounding box of its pixels, from one chunked pass over the pixel map
+def reachWindows(pixMap, reaches=None):
+  pixMap = ftl.openRaster(pixMap)
+  boxes = {}
+  for r0 in range(0, pixMap.shape[0], ROW_CHUNK):
+    chunk = np.asarray(pixMap[r0:r0 + ROW_CHUNK])
+    rows, cols = np.nonzero(chunk > 0)
+    if len(rows) == 0:
+      continue
+    reach = fd.nodeReach(chunk[rows, cols])
+    ids, inverse = np.unique(reach, return_inverse=True)
+    n = len(ids)
+    rmin = np.full(n, np.iinfo(np.int64).max); np.minimum.at(rmin, inverse, rows)
+    rmax = np.full(n, -1); np.maximum.at(rmax, inverse, rows)
+    cmin = np.full(n, np.iinfo(np.int64).max); np.minimum.at(cmin, inverse, cols)
+    cmax = np.full(n, -1); np.maximum.at(cmax, inverse, cols)
+    for i, r in enumerate(ids.tolist()):
+      box = (r0 + int(rmin[i]), r0 + int(rmax[i]) + 1, int(cmin[i]), int(cmax[i]) + 1)
+      if r in boxes:
+        old = boxes[r]
+        box = (min(old[0], box[0]), max(old[1], box[1]), min(old[2], box[2]), max(old[3], box[3]))
+      boxes[r] = box
+  if reaches is not None:
+    boxes = {r: boxes[r] for r in reaches if r in boxes}
+  return boxes
+
+
+_worker = {}
+
+#opens the inputs once per process; stageLog installs a stage recorder writing to it
+#(a recorder of the parent process does not reach the pool workers)
+def _initWorker(config, stageLog=None):
+  _worker['pixMap'] = ftl.openRaster(config['pixMap'])
+  _worker['epochs'] = [{name: (ftl.openRaster(v) if name != 'year' else v) for name, v in config[e].items()}
+                       for e in ('epoch1', 'epoch2')]
+  _worker['scale'] = config.get('scale', 30)
+  _worker['maxDistance'] = config.get('maxDistance', 1000)
+  if stageLog is not None:
+    return fm.recordStages(fm.StageTimes(fm.MetricsLog(stageLog)))
+
+
+#(reach, node ids, (nDataColumns, nNodes) float32) of one reach window
+def runReach(task):
+  reach, box = task
+  pixMap, (epoch1, epoch2) = _worker['pixMap'], _worker['epochs']
+  scale, maxDistance = _worker['scale'], _worker['maxDistance']
+  halo = ftl.haloSize(maxDistance, scale)
+  H, W = pixMap.shape
+  #local counterpart of filterSword: the reach ROI (its window) and its nodes
+  with fm.stage('filterSword', reach=reach):
+    window = (slice(max(box[0] - halo, 0), min(box[1] + halo, H)),
+              slice(max(box[2] - halo, 0), min(box[3] + halo, W)))
+
+    #only this reach's nodes are summarized, neighbours inside the window belong to other tasks
+    pix = np.asarray(pixMap[window])
+    nodeIds = np.unique(pix[(pix > 0) & (fd.nodeReach(np.maximum(pix, 0)) == reach)])
+  with fm.stage('calcMigration', reach=reach):
+    mData = fml.calcMigration(ftl.epochWindow(epoch1, window), ftl.epochWindow(epoch2, window),
+                              scale, maxDistance=maxDistance)
+  with fm.stage('calcStats', reach=reach):
+    table = fnl.calcStats(mData, pix, nodeIds)
+  return reach, table['node_id'], np.array([table[name] for name in dataNames], dtype=np.float32)
+
+
+#numbered parts with node_id, reach_id and the data columns, one per flushEvery reaches
+class PartWriter:
+  def __init__(self, outDir, flushEvery=FLUSH_EVERY):
+    self.outDir = outDir
+    self.flushEvery = flushEvery
+    self.results = []
+    os.makedirs(outDir, exist_ok=True)
+    self.nParts = len(glob.glob(os.path.join(outDir, 'part*.npz')))
+
+  def add(self, result):
+    self.results.append(result)
+    if len(self.results) >= self.flushEvery:
+      self.flush()
+
+  def flush(self):
+    if not self.results:
+      return
+    reaches, ids, data = zip(*self.results)
+    columns = {'node_id': np.concatenate(ids),
+               'reach_id': np.concatenate([np.full(len(i), r, dtype=np.int64) for r, i in zip(reaches, ids)])}
+    data = np.concatenate(data, axis=1)
+    for i, name in enumerate(dataNames):
+      columns[name] = fs.storageColumn(name, data[i])
+    path = os.path.join(self.outDir, 'part{0:06}.npz'.format(self.nParts))
+    #written aside first, a part that exists is complete
+    tmp = os.path.join(self.outDir, 'writing.npz')
+    np.savez(tmp, **columns)
+    os.replace(tmp, path)
+    self.nParts += 1
+    self.results = []
+
+
+#reaches already written to outDir, so an interrupted run can continue
+def doneReaches(outDir):
+  done = set()
+  for path in glob.glob(os.path.join(outDir, 'part*.npz')):
+    with np.load(path) as part:
+      done.update(np.unique(part['reach_id']).tolist())
+  return done
+
+
+#runs every reach of the pixel map (or only reaches) not yet in outDir. Returns the reach count.
+def runLocal(config, outDir, workers=None, reaches=None, flushEvery=FLUSH_EVERY, stageLog=None):
+  workers = workers or os.cpu_count()
+  done = doneReaches(outDir)
+  windows = reachWindows(config['pixMap'], reaches)
+  #largest windows first so the pool does not end on one long reach
+  tasks = sorted(((r, box) for r, box in windows.items() if r not in done),
+                 key=lambda t: -(t[1][1] - t[1][0]) * (t[1][3] - t[1][2]))
+
+  writer = PartWriter(outDir, flushEvery)
+  if workers > 1:
+    with multiprocessing.Pool(workers, _initWorker, (config, stageLog)) as pool:
+      for result in pool.imap_unordered(runReach, tasks, chunksize=1):
+        writer.add(result)
+  else:
+    previous = _initWorker(config, stageLog)
+    try:
+      for task in tasks:
+        writer.add(runReach(task))
+    finally:
+      if stageLog is not None:
+        fm.recordStages(previous)
+  writer.flush()
+  return len(tasks)
+
+
+if __name__ == "__main__":
+  with open(sys.argv[1]) as f:
+    config = json.load(f)
+  workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+  stageLog = sys.argv[4] if len(sys.argv) > 4 else None
+  print("{0} reaches".format(runLocal(config, sys.argv[2], workers, stageLog=stageLog)))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+output schema of the SCREAMinG node tables
+
+One entry per column the pipeline adds to the SWORD nodes: its storage dtype
+and the value written where a node has no data. Used by the Earth Engine fill
+(functions_nodeSummary.fillMissing), the local engines and functions_dataset.
+
+"""
+import numpy as np
+
+#(column, storage dtype, missing value)
+dataColumns = [
+  ('ADiff', 'float32', -1),
+  ('EDiff', 'float32', -1),
+  ('t1_mask', 'float32', -1),
+  ('t2_mask', 'float32', -1),
+  ('t1_bankLen', 'float32', -1),
+  ('t2_bankLen', 'float32', -1),
+  ('noisyADiff', 'float32', -1),
+  ('noisyEDiff', 'float32', -1),
+  ('ARate', 'float32', -1),
+  ('ERate', 'float32', -1),
+  ('ADir', 'float32', -9999),
+  ('ADirR', 'float32', -1),
+  ('EDir', 'float32', -9999),
+  ('EDirR', 'float32', -1)]
+
+#keys, never missing
+idColumns = [
+  ('node_id', 'int64'),
+  ('reach_id', 'int64'),
+  ('year1', 'int16'),
+  ('year2', 'int16')]
+
+missingValues = {name: missing for name, _, missing in dataColumns}
+dtypes = dict([(name, dtype) for name, dtype, _ in dataColumns] + idColumns)
+
+
+#node table column -> storage array: schema dtype, missing values as NaN.
+#columns outside the schema are returned unchanged.
+def storageColumn(name, values):
+  values = np.asarray(values)
+  if name not in dtypes:
+    return values
+  if name in missingValues:
+    values = np.where(values == missingValues[name], np.nan, values)
+  return values.astype(dtypes[name])
+
+
+def storageTable(table):
+  return {name: storageColumn(name, col) for name, col in table.items()}
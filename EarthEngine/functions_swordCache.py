@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local cache of SWORD reach and node metadata
+
+One compressed .npz per SWORD version with the reach table sorted by reach_id
+and the nodes grouped by reach, so node_offset[i]:node_offset[i+1] are the
+nodes of reach_id[i].
+
+"""
+import os
+import numpy as np
+from functions_context import ctx
+
+ASSET_ROOT = "users/tedlanghorst/"
+
+#columns pulled from the SWORD assets
+REACH_COLUMNS = ['reach_id', 'n_nodes', 'width', 'reach_len']
+NODE_COLUMNS = ['node_id', 'reach_id', 'width', 'x', 'y']
+
+#reach_ids are 11 digits, the first two are the basin. One request per basin keeps getInfo payloads small.
+BASIN_STEP = 1000000000
+
+
+def cachePath(version, cacheDir='.'):
+  return os.path.join(cacheDir, "SWORD_{0}.npz".format(version))
+
+
+def _fetchColumns(collection, columns):
+  ee = ctx.initialize()
+  rows = []
+  for basin in range(10, 100):
+    lo = basin * BASIN_STEP
+    part = (collection.filter(ee.Filter.gte('reach_id', lo))
+            .filter(ee.Filter.lt('reach_id', lo + BASIN_STEP))
+            .reduceColumns(ee.Reducer.toList(len(columns)), columns)
+            .get('list').getInfo())
+    rows.extend(part)
+  return np.array(rows, dtype=np.float64).reshape(-1, len(columns))
+
+
+#pull the reach and node tables from Earth Engine once and write the cache
+def buildCache(version, cacheDir='.'):
+  ee = ctx.initialize()
+  reaches = _fetchColumns(ee.FeatureCollection(ASSET_ROOT + "SWORD_reach_" + version), REACH_COLUMNS)
+  nodes = _fetchColumns(ee.FeatureCollection(ASSET_ROOT + "SWORD_node_" + version), NODE_COLUMNS)
+  return writeCache(cachePath(version, cacheDir), version, reaches, nodes)
+
+
+#reaches and nodes are row arrays in REACH_COLUMNS / NODE_COLUMNS order
+def writeCache(path, version, reaches, nodes):
+  reachId = reaches[:, 0].astype(np.int64)
+  order = np.argsort(reachId, kind='stable')
+  reachId = reachId[order]
+  reaches = reaches[order]
+
+  nodeReach = nodes[:, 1].astype(np.int64)
+  nodeId = nodes[:, 0].astype(np.int64)
+  nodeOrder = np.lexsort((nodeId, nodeReach))
+  nodes = nodes[nodeOrder]
+  nodeReach = nodeReach[nodeOrder]
+
+  #nodes of reaches missing from the reach table are dropped
+  keep = np.isin(nodeReach, reachId)
+  nodes = nodes[keep]
+  nodeReach = nodeReach[keep]
+  offset = np.searchsorted(nodeReach, reachId, side='left')
+  offset = np.append(offset, len(nodeReach)).astype(np.int64)
+
+  #mean node width per reach, as filterSword computes it on the server
+  counts = np.diff(offset)
+  widthSum = np.add.reduceat(nodes[:, 2], offset[:-1][counts > 0]) if len(nodes) else np.zeros(0)
+  nodeWidth = np.full(len(reachId), np.nan)
+  nodeWidth[counts > 0] = widthSum / counts[counts > 0]
+
+  np.savez_compressed(path,
+    version = np.array(version),
+    reach_id = reachId,
+    reach_nNodes = reaches[:, 1].astype(np.int32),
+    reach_width = reaches[:, 2].astype(np.float32),
+    reach_len = reaches[:, 3].astype(np.float32),
+    reach_nodeWidth = nodeWidth.astype(np.float32),
+    node_offset = offset,
+    node_id = nodes[:, 0].astype(np.int64),
+    node_width = nodes[:, 2].astype(np.float32),
+    node_x = nodes[:, 3],
+    node_y = nodes[:, 4])
+  return path
+
+
+class SwordCache:
+  def __init__(self, path, version=None):
+    with np.load(path) as data:
+      self.arrays = {k: data[k] for k in data.files}
+    self.version = str(self.arrays['version'])
+    if version is not None and version != self.version:
+      raise ValueError("{0} holds SWORD {1}, not {2}".format(path, self.version, version))
+    self.reachIds = self.arrays['reach_id']
+    self.offset = self.arrays['node_offset']
+
+  @classmethod
+  def load(cls, version, cacheDir='.'):
+    path = cachePath(version, cacheDir)
+    if not os.path.exists(path):
+      buildCache(version, cacheDir)
+    return cls(path, version)
+
+  #row of a reach in the reach table
+  def index(self, reach):
+    i = np.searchsorted(self.reachIds, reach)
+    if i >= len(self.reachIds) or self.reachIds[i] != reach:
+      raise KeyError(reach)
+    return i
+
+  def reach(self, column):
+    return self.arrays['reach_' + column]
+
+  #node columns ('id', 'x', 'y', 'width') of one reach
+  def nodes(self, reach, column='id'):
+    i = self.index(reach)
+    return self.arrays['node_' + column][self.offset[i]:self.offset[i+1]]
+
+  #mean node width, with filterSword's replacement of missing widths
+  def width(self, reach):
+    w = float(self.arrays['reach_nodeWidth'][self.index(reach)])
+    return 500.0 if w == 1 else w
@@ -9,41 +9,191 @@ Created on Wed Jun  3 10:51:26 2020
 import os 
 import time
 import datetime
+from collections import deque
 import ee
+from functions_context import ctx
+import functions_metrics as fm
 
 
+#states that still hold an export slot
+ACTIVE_STATES = ('READY', 'RUNNING')
+#states of a journaled task that a resumed run can pick up instead of resubmitting
+RESUMABLE_STATES = ACTIVE_STATES + ('COMPLETED',)
 
-def maximum_no_of_tasks(MaxNActive, waitingPeriod):
+
+#task state of every operation state (ee.data.listOperations/getOperation)
+OPERATION_STATES = {'PENDING': 'READY', 'RUNNING': 'RUNNING', 'CANCELLING': 'CANCEL_REQUESTED',
+                    'SUCCEEDED': 'COMPLETED', 'CANCELLED': 'CANCELLED', 'FAILED': 'FAILED'}
+
+
+#RFC 3339 timestamp of an operation -> milliseconds since the epoch
+def _msec(timestamp):
+  if not timestamp:
+    return None
+  seconds, _, fraction = timestamp.rstrip('Z').partition('.')
+  t = datetime.datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+  return int(t.timestamp())*1000 + int((fraction + '000')[:3])
+
+
+#operation -> the task status layout runExports and functions_metrics read
+#(id, state, *_timestamp_ms, batchEecuUsageSeconds, error_message)
+def operationStatus(operation):
+  meta = operation.get('metadata', {})
+  status = {'id': operation['name'].rsplit('/', 1)[-1],
+            'name': operation['name'],
+            'description': meta.get('description'),
+            'state': OPERATION_STATES.get(meta.get('state'), 'UNKNOWN'),
+            'creation_timestamp_ms': _msec(meta.get('createTime')),
+            'start_timestamp_ms': _msec(meta.get('startTime')),
+            'update_timestamp_ms': _msec(meta.get('updateTime')),
+            'batchEecuUsageSeconds': meta.get('batchEecuUsageSeconds')}
+  if operation.get('done') and 'error' in operation:
+    status['error_message'] = operation['error'].get('message')
+  return status
+
+
+#ee.batch backend for runExports. buildTask(job) returns an unstarted export task.
+#task states come from the operations API (getTaskStatus/getTaskList are deprecated).
+class EETaskService:
+  def __init__(self, buildTask=None):
+    self.buildTask = buildTask
+    #task id -> operation name
+    self.names = {}
+    ctx.initialize()
+
+  def submit(self, job):
+    task = self.buildTask(job)
+    task.start()
+    self.names[task.id] = task.name
+    return task.id
+
+  def status(self, taskId):
+    if taskId not in self.names:
+      self.list()
+    return operationStatus(ee.data.getOperation(self.names[taskId]))
+
+  #every task of the account in one request
+  def list(self):
+    statuses = [operationStatus(op) for op in ee.data.listOperations()]
+    self.names.update((s['id'], s['name']) for s in statuses)
+    return statuses
+
+  def time(self):
+    return time.time()
+
+  def sleep(self, seconds):
+    time.sleep(seconds)
+
+
+#stand-in for the Earth Engine task queue with a virtual clock, for tests and benchmarks.
+#runtime(job) gives the seconds a job runs, queueTime the seconds it sits in READY.
+class FakeTaskService:
+  def __init__(self, runtime, queueTime=0, finalState='COMPLETED'):
+    self.runtime = runtime
+    self.queueTime = queueTime
+    self.finalState = finalState
+    self.now = 0.0
+    self.tasks = {}
+    self.nListCalls = 0
+
+  def submit(self, job):
+    taskId = 'FAKE{0:06}'.format(len(self.tasks))
+    start = self.now + self.queueTime
+    self.tasks[taskId] = {'id': taskId,
+                          'description': job['description'],
+                          'creation_timestamp_ms': int(self.now*1000),
+                          'start_timestamp_ms': int(start*1000),
+                          'end': start + self.runtime(job)}
+    return taskId
+
+  def status(self, taskId):
+    task = self.tasks[taskId]
+    if self.now < task['start_timestamp_ms']/1000:
+      state = 'READY'
+    elif self.now < task['end']:
+      state = 'RUNNING'
+    else:
+      state = self.finalState
+    update = min(self.now, task['end']) if state != 'READY' else self.now
+    status = {k: v for k, v in task.items() if k != 'end'}
+    status.update(state=state, update_timestamp_ms=int(update*1000))
+    return status
+
+  def list(self):
+    self.nListCalls += 1
+    return [self.status(taskId) for taskId in self.tasks]
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+
+#one snapshot of every task state, refreshed with a single list call and shared by all waiters.
+#the refresh interval doubles (up to maxPeriod) while nothing changes and drops back
+#to waitingPeriod as soon as a task changes state or a new one is submitted.
+class TaskCache:
+  def __init__(self, service, waitingPeriod, maxPeriod=300, backoff=2):
+    self.service = service
+    self.waitingPeriod = max(waitingPeriod, 10)
+    self.maxPeriod = max(maxPeriod, self.waitingPeriod)
+    self.backoff = backoff
+    self.period = self.waitingPeriod
+    self.snapshot = {}
+    self.refresh()
+
+  def refresh(self):
+    old = {taskId: s.get('state') for taskId, s in self.snapshot.items()}
+    self.snapshot = {s['id']: s for s in self.service.list()}
+    new = {taskId: s.get('state') for taskId, s in self.snapshot.items()}
+    if new != old:
+      self.period = self.waitingPeriod
+    else:
+      self.period = min(self.period*self.backoff, self.maxPeriod)
+
+  #sleep until the next refresh is due, then refresh
+  def wait(self):
+    self.service.sleep(self.period)
+    self.refresh()
+
+  #something changed on our side, poll again soon
+  def reset(self):
+    self.period = self.waitingPeriod
+
+  #tasks submitted since the last refresh are not listed yet, report them as READY
+  def status(self, taskId):
+    return self.snapshot.get(taskId, {'id': taskId, 'state': 'READY'})
+
+  def state(self, taskId):
+    return self.status(taskId).get('state')
+
+  def nActive(self):
+    return sum(s.get('state') in ACTIVE_STATES for s in self.snapshot.values())
+
+
+def maximum_no_of_tasks(MaxNActive, waitingPeriod, cache=None):
   ##maintain a maximum number of active tasks
-  time.sleep(10)
-  ## initialize submitting jobs
-  ts = list(ee.batch.Task.list())
-
-  NActive = 0
-  for task in ts:
-       if ('RUNNING' in str(task) or 'READY' in str(task)):
-           NActive += 1
+  if cache is None:
+    cache = TaskCache(EETaskService(), waitingPeriod)
+  ## give just-submitted tasks time to show up
+  cache.wait()
   ## wait if the number of current active tasks reach the maximum number
   ## defined in MaxNActive
-  while (NActive >= MaxNActive):
-      time.sleep(waitingPeriod) # if reach or over maximum no. of active tasks, wait
-      ts = list(ee.batch.Task.list())
-      NActive = 0
-      for task in ts:
-        if ('RUNNING' in str(task) or 'READY' in str(task)):
-          NActive += 1
+  while (cache.nActive() >= MaxNActive):
+    cache.wait() # if reach or over maximum no. of active tasks, wait
   return
 
-def taskMonitor(exportTask, waitingPeriod):
-  
-  if (waitingPeriod < 10):
-    waitingPeriod = 10  
-  state = exportTask.status().get('state')
+def taskMonitor(exportTask, waitingPeriod, cache=None):
+  if cache is None:
+    cache = TaskCache(EETaskService(), waitingPeriod)
+  cache.reset()
+  state = cache.state(exportTask.id)
   
   #still running
-  while (state=='RUNNING' or state=='READY'):
-    time.sleep(waitingPeriod)
-    state = exportTask.status().get('state')
+  while (state in ACTIVE_STATES):
+    cache.wait()
+    state = cache.state(exportTask.id)
 
   #complete
   # if (state=='COMPLETED'):
@@ -51,7 +201,7 @@ def taskMonitor(exportTask, waitingPeriod):
   # else:
     # os.system('afplay Sounds/failTrombone.wav')
   
-  status = exportTask.status()  
+  status = cache.status(exportTask.id)
   dSeconds = (status.get('update_timestamp_ms')-status.get('start_timestamp_ms'))//1000
   dt = datetime.timedelta(0,dSeconds)
   print(state + "\truntime: " + str(dt))
@@ -60,10 +210,98 @@ def taskMonitor(exportTask, waitingPeriod):
 
 def cancelAllTasks():
   for t in ee.batch.Task.list():
-    if ('RUNNING' in str(t) or 'READY' in str(t)):
+    if (t.state in ACTIVE_STATES):
       #for some reach the cancel method throws a 404 error, but only after cancelling the task. Skipping the exception allows you to keep going and cancel them all.
         try:
             t.cancel()
         except Exception:
             pass
-            
\ No newline at end of file
+
+
+#keep up to maxActive exports running, submitting the next job whenever a slot frees up.
+#jobs are dicts with at least 'description' and 'reaches'. Returns one record per job.
+#with a journal (functions_journal.RunJournal), completed jobs are skipped and jobs
+#still running (or completed while nobody watched) from an earlier run are polled
+#again instead of being resubmitted; ones that failed meanwhile are resubmitted.
+#with metrics (functions_metrics.MetricsLog), every finished task is written there.
+#maxPeriod caps the TaskCache backoff; maxPeriod=waitingPeriod polls at a fixed rate.
+def runExports(jobs, service, maxActive, waitingPeriod, journal=None, metrics=None, maxPeriod=300):
+  cache = TaskCache(service, waitingPeriod, maxPeriod)
+  pending = deque(jobs)
+  active = {}
+  records = []
+  t0 = service.time()
+  nDone = 0
+
+  if journal is not None:
+    done = journal.completed()
+    inFlight = journal.inFlight()
+    pending = deque()
+    for job in jobs:
+      if job['description'] in done:
+        continue
+      taskId = inFlight.get(job['description'])
+      if taskId is not None and cache.snapshot.get(taskId, {}).get('state') in RESUMABLE_STATES:
+        active[taskId] = {'job': job,
+                          'description': job['description'],
+                          'nReaches': len(job['reaches']),
+                          'taskId': taskId}
+      else:
+        pending.append(job)
+    print("{0} jobs already completed, resuming {1} running, {2} to submit".format(
+      len(jobs)-len(pending)-len(active), len(active), len(pending)))
+
+  while pending or active:
+    #fill the free slots
+    while pending and len(active) < maxActive:
+      job = pending.popleft()
+      taskId = service.submit(job)
+      if journal is not None:
+        journal.record(job, 'SUBMITTED', taskId)
+      active[taskId] = {'job': job,
+                        'description': job['description'],
+                        'nReaches': len(job['reaches']),
+                        'taskId': taskId}
+      now = time.localtime()
+      print("{0:02}:{1:02}\t submitting {2} reaches as {3} ({4} active)".format(
+        now.tm_hour,now.tm_min,len(job['reaches']),job['description'],len(active)))
+      cache.reset()
+
+    #one list call per refresh serves every active task
+    cache.wait()
+
+    for taskId in list(active):
+      status = cache.status(taskId)
+      state = status.get('state')
+      if state in ACTIVE_STATES:
+        continue
+
+      record = active.pop(taskId)
+      job = record.pop('job')
+      taskStats = fm.taskMetrics(job, status)
+      record['state'] = state
+      if taskStats['runtime'] is not None:
+        record['runtime'] = int(taskStats['runtime'])
+      else:
+        record['runtime'] = None
+      record['queueWait'] = taskStats['queueWait']
+      record['eecu'] = taskStats['eecu']
+      records.append(record)
+      if metrics is not None:
+        metrics.write(taskStats)
+      if journal is not None:
+        journal.record(job, state, taskId, record['runtime'])
+
+      if state == 'COMPLETED':
+        nDone += record['nReaches']
+      hours = (service.time() - t0)/3600
+      rate = nDone/hours if hours > 0 else 0.0
+      print("{0}\t{1}\truntime: {2}\t{3:.0f} reaches/hour".format(
+        record['description'], state,
+        datetime.timedelta(0,record['runtime'] or 0), rate))
+
+  hours = (service.time() - t0)/3600
+  print("{0} exports, {1} reaches in {2}, {3:.0f} reaches/hour".format(
+    len(records), nDone, datetime.timedelta(0,int(hours*3600)),
+    nDone/hours if hours > 0 else 0.0))
+  return records
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tiled local processing of rasters too large to hold in memory
+
+Inputs are 2-D arrays on disk (.npy files opened with mmap_mode='r', or any
+np.memmap), so only the window of the current tile is ever read. Every tile is
+read with a halo wide enough for the 3x3 kernels and the bounded cost distance,
+run through bankCalcs -> calcMigration -> statSums, and only the per-node sums
+of its core pixels are kept. Sums of nodes that straddle tiles are added up
+before finalizeStats, so peak memory follows the tile size, not the region.
+
+The one difference to processing the whole raster at once: islands are
+measured from the centre of the part of the island inside the tile window, so
+islands larger than the halo can get slightly different distances.
+
+"""
+import math
+import numpy as np
+import functions_watermask_local as fwl
+import functions_migration_local as fml
+import functions_nodeSummary_local as fnl
+import functions_metrics as fm
+
+#pixels of context the 3x3 stages need on top of the cost distance
+#(bank pixels, bank aspect and the focal max of the cost image)
+KERNEL_HALO = 3
+
+
+#.npy path -> read-only memory map, arrays are passed through
+def openRaster(raster):
+  if isinstance(raster, str):
+    return np.load(raster, mmap_mode='r')
+  return raster
+
+
+#halo in pixels for cumulativeCost(maxDistance) plus the kernels
+def haloSize(maxDistance, scale=30):
+  return int(math.ceil(maxDistance / scale)) + KERNEL_HALO
+
+
+#(window, core) slices for every tile: window is the tile plus its halo in raster
+#coordinates, core the tile itself in window coordinates.
+def tiles(shape, tileSize, halo):
+  H, W = shape
+  for r0 in range(0, H, tileSize):
+    for c0 in range(0, W, tileSize):
+      r1, c1 = min(r0 + tileSize, H), min(c0 + tileSize, W)
+      wr0, wc0 = max(r0 - halo, 0), max(c0 - halo, 0)
+      wr1, wc1 = min(r1 + halo, H), min(c1 + halo, W)
+      yield ((slice(wr0, wr1), slice(wc0, wc1)),
+             (slice(r0 - wr0, r1 - wr0), slice(c0 - wc0, c1 - wc0)))
+
+
+#water mask bands of one epoch inside a window. epoch holds 'year', the river
+#'mask' and 'watermask' and optionally 'noData', 'noisyRiverMask' and 'noisyWaterMask'
+#(without the noisy masks the noisy diffs come out as missing values).
+def epochWindow(epoch, window):
+  bands = {name: np.asarray(openRaster(band)[window], dtype=np.float32)
+           for name, band in epoch.items() if name != 'year'}
+  wm = fwl.bankCalcs(bands.pop('mask'))
+  wm.update(bands)
+  wm['year'] = epoch['year']
+  return wm
+
+
+#per-tile (ids, sums) of statSums over the core pixels of every tile, see module docstring
+def tileSums(epoch1, epoch2, pixMap, tileSize=1024, scale=30, maxDistance=1000, nodeIds=None):
+  pixMap = openRaster(pixMap)
+  halo = haloSize(maxDistance, scale)
+  for window, core in tiles(pixMap.shape, tileSize, halo):
+    tilePix = np.asarray(pixMap[window])[core]
+    if not (tilePix > 0).any():
+      continue
+    tile = (window[0].start, window[1].start)
+    with fm.stage('calcMigration', tile=tile):
+      mData = fml.calcMigration(epochWindow(epoch1, window), epochWindow(epoch2, window),
+                                scale, maxDistance=maxDistance)
+    #statSums only needs the bands it reads, cropped to the core
+    coreData = {name: band[core] for name, band in mData.items() if np.ndim(band) == 2}
+    with fm.stage('calcStats', tile=tile):
+      sums = fnl.statSums(coreData, tilePix, nodeIds)
+    yield sums
+
+
+#add up (ids, sums) pairs that may repeat nodes
+def mergeSums(parts):
+  parts = [p for p in parts if len(p[0])]
+  if not parts:
+    return np.zeros(0, dtype=np.int64), {}
+  ids, inverse = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+  sums = {name: np.bincount(inverse, np.concatenate([p[1][name] for p in parts]), minlength=len(ids))
+          for name in parts[0][1]}
+  return ids, sums
+
+
+#like functions_nodeSummary_local.calcStats over a raster of any size. Tile sums are
+#merged every mergeEvery tiles so the pending parts stay small. With stageLog the
+#per-tile stage timings are appended there (functions_metrics.MetricsLog).
+def calcStatsTiled(epoch1, epoch2, pixMap, nodeIds=None, tileSize=1024, scale=30,
+                   maxDistance=1000, mergeEvery=64, stageLog=None):
+  if stageLog is not None:
+    previous = fm.recordStages(fm.StageTimes(fm.MetricsLog(stageLog)))
+  try:
+    merged = []
+    pending = []
+    for part in tileSums(epoch1, epoch2, pixMap, tileSize, scale, maxDistance, nodeIds):
+      pending.append(part)
+      if len(pending) >= mergeEvery:
+        merged = [mergeSums(merged + pending)]
+        pending = []
+    ids, sums = mergeSums(merged + pending)
+  finally:
+    if stageLog is not None:
+      fm.recordStages(previous)
+
+  stats = fnl.finalizeStats(ids, sums) if len(ids) else {'node_id': ids}
+  if nodeIds is None:
+    return stats
+  return fnl.withMissing(np.asarray(nodeIds, dtype=np.int64), stats)
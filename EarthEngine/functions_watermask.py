@@ -8,56 +8,55 @@ April 2020
 
 """
 import ee
+from functions_context import ctx
 # from random import randint
 
-jrcMetadata = ee.Image("JRC/GSW1_2/Metadata")
-jrcYearly = ee.ImageCollection("JRC/GSW1_2/YearlyHistory")
-jrcMonthly = ee.ImageCollection("JRC/GSW1_2/MonthlyHistory")
-pickensYearly = ee.ImageCollection("projects/glad/water/annual")
-sword = ee.FeatureCollection("users/tedlanghorst/SWORD_node_v09")
+#assets and kernels are built on first use (see functions_context), not at import.
+_lazyNames = ('jrcMetadata', 'jrcYearly', 'jrcMonthly', 'pickensYearly', 'sword',
+              'daKernel', 'directionKernel', 'kernelValues', 'aspectKey')
 
-def filterSword(r1, r2, WIDTH_BUFF):
-  sword_clip = sword.filterMetadata('reach_id','equals',ee.Number(r1)) #v08
+def __getattr__(name):
+  if name in _lazyNames:
+    return getattr(ctx, name)
+  raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+#width can be passed in (e.g. from functions_swordCache) to skip the server-side node scan.
+def filterSword(r1, r2, WIDTH_BUFF, width=None):
+  sword_clip = ctx.sword.filterMetadata('reach_id','equals',ee.Number(r1)) #v08
   
-  swordWidth = ee.Number(sword_clip.reduceColumns(ee.Reducer.mean(),['width']).getNumber("mean"))
-  #replace missing width values with static.
-  width = ee.Number(ee.Algorithms.If(
-    condition = swordWidth.eq(1),
-    trueCase = 500,
-    falseCase = swordWidth))
+  if width is None:
+    swordWidth = ee.Number(sword_clip.reduceColumns(ee.Reducer.mean(),['width']).getNumber("mean"))
+    #replace missing width values with static.
+    width = ee.Number(ee.Algorithms.If(
+      condition = swordWidth.eq(1),
+      trueCase = 500,
+      falseCase = swordWidth))
+  else:
+    width = ee.Number(width)
   
   roi = sword_clip.geometry().buffer(width.multiply(WIDTH_BUFF))
   
   return sword_clip.set('width',width,'widthBuff',WIDTH_BUFF,'roi',roi)
 
 
-daKernel = ee.Kernel.fixed(3,3,
-[[0.5,  0.5, 0.5],
-[0.5,  -1,  0.5],
-[0.5,  0.5, 0.5]])
-
-#kernel that gives unique value for each bank orientation in 3x3
-directionKernel = ee.Kernel.fixed(3,3,
-[[128,  1, 2],
- [ 64,  256, 4],
- [ 32, 16, 8]])
-
-#translate kernel values to angles. Found these using a MATLAB script.
-kernelValues = ee.List([1, 4, 16, 64, 129, 3, 6, 12, 24, 48, 96, 192, 131, 7, 14, 28, 56, 112, 224, 193, 135, 15, 30, 60, 120, 240, 225, 195, 143, 31, 62, 124, 248, 241, 227, 199, 159, 63, 126, 252, 249, 243, 231, 207])
-
-aspectKey = ee.List([4.712389, 0.000000, 1.570796, 3.141593, 4.467410, 4.957368, 6.038207, 0.244979, 1.325818, 1.815775, 2.896614, 3.386571, 4.712389, 5.497787, 0.000000, 0.785398, 1.570796, 2.356194, 3.141593, 3.926991, 5.092895, 5.902679, 0.380506, 1.190290, 1.951303, 2.761086, 3.522099, 4.331883, 5.497787, 0.000000, 0.785398, 1.570796, 2.356194, 3.141593, 3.926991, 4.712389, 5.695183, 0.588003, 0.982794, 2.158799, 2.553590, 3.729595, 4.124386, 5.300392])
-
-
 #calculates the derivative of the bank angles
 #transform angles to x,y vecs, find derivatives, calculate angle.
 def circularDerivative(image):
   xy = image.cos().rename('x').addBands(image.sin().rename('y'))
-  dxy = xy.convolve(daKernel)
+  dxy = xy.convolve(ctx.daKernel)
   dTheta = dxy.select('x').atan2(dxy.select('y'))
   return dTheta
 
 
+#bodies of at least this many pixels all count as "large" for connectedPixelCount (its cap)
+BODY_MAXSIZE = 1024
+
 #fill in all non water regions with area smaller than areaMax
+#land regions are sized in raster form (4-connected, like the old eightConnected=False
+#polygons). only regions at the BODY_MAXSIZE cap, whose size the raster does not know,
+#are vectorized and measured as polygons, so large ROIs (areaMax above ~0.9 km2 at
+#30 m) fill the same regions as the polygon version. speckle never reaches reduceToVectors.
 def fillBars(image, roi):
   def calcArea(feat):
     a = feat.geometry().area(1000)
@@ -65,20 +64,42 @@ def fillBars(image, roi):
     return feat.set("fill", bars)
   
   areaMax = ee.Geometry(roi).area().divide(25)
-  barPolys = image.unmask().Not().selfMask().reduceToVectors(
+  #clipped first so regions are cut at the roi edge like the polygons were
+  land = image.unmask().Not().selfMask().clip(roi)
+  landSize = land.connectedPixelCount(BODY_MAXSIZE, False)
+  smallBars = (landSize.lt(BODY_MAXSIZE)
+               .And(landSize.multiply(ee.Image.pixelArea()).lte(ee.Image.constant(areaMax))))
+  
+  largePolys = land.updateMask(landSize.gte(BODY_MAXSIZE)).reduceToVectors(
     geometry = roi,
     scale = 30,
     eightConnected = False,
     maxPixels = 1E10,
     bestEffort = True).map(calcArea)
+  largeBars = ee.Image(0).paint(largePolys, "fill")
   
-  filled = image.selfMask().paint(barPolys,"fill");
+  bars = smallBars.unmask().Or(largeBars)
+  filled = image.unmask().Or(bars).clip(roi)
   
   return filled
 
 def largestBody(image, roi):
+  water = image.selfMask()
+  
+  #4-connected body size per pixel (capped at BODY_MAXSIZE), in raster form
+  bodySize = water.connectedPixelCount(BODY_MAXSIZE, False)
+  maxSize = ee.Number(bodySize.reduceRegion(
+    reducer = ee.Reducer.max(),
+    geometry = roi,
+    scale = 30,
+    maxPixels = 1E10).values().get(0))
+  
+  #only bodies that can be the largest get vectorized: the largest one if it is below
+  #the cap, otherwise every body at the cap. speckle never reaches reduceToVectors.
+  candidates = water.updateMask(bodySize.gte(maxSize.min(BODY_MAXSIZE)))
+  
   #water body outlines
-  maskVec = image.selfMask().reduceToVectors(
+  maskVec = candidates.reduceToVectors(
     geometry = roi,
     scale = 30,
     eightConnected = False,
@@ -91,18 +112,18 @@ def largestBody(image, roi):
   return riverMask
 
 def bankCalcs(riverMask):
-  bankAspect = (riverMask.unmask().convolve(directionKernel)
-  .remap(kernelValues, aspectKey).rename("bankAspect"))
+  bankAspect = (riverMask.unmask().convolve(ctx.directionKernel)
+  .remap(ctx.kernelValues, ctx.aspectKey).rename("bankAspect"))
   
   banks = bankAspect.add(9999).neq(0).selfMask().rename('banks')
   
-  bankCurvature = bankAspect.convolve(daKernel).rename('bankCurv')
+  bankCurvature = bankAspect.convolve(ctx.daKernel).rename('bankCurv')
   bankLen = banks.convolve(ee.Kernel.euclidean(1)).rename('bankLen')
   
   return riverMask.addBands([banks, bankAspect, bankCurvature, bankLen])
 
 def addNoise(year1, year2, roi, errorRates):
-  nobs = jrcMetadata.select('valid_obs').reduceRegion(ee.Reducer.mean(),roi).getNumber('valid_obs')
+  nobs = ctx.jrcMetadata.select('valid_obs').reduceRegion(ee.Reducer.mean(),roi).getNumber('valid_obs')
   nObsYr = nobs.divide(36).toInt()
   
   def addYearNoise(img):
@@ -127,84 +148,64 @@ def addNoise(year1, year2, roi, errorRates):
     
     return yearMask
     
-  yearMasks = jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year')).map(addYearNoise)
+  yearMasks = ctx.jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year')).map(addYearNoise)
   
   noisyMask = ee.ImageCollection(yearMasks).reduce(ee.Reducer.mean()).gte(0.5)
   return noisyMask
 
-def addNoise_pekel_distance(year1, year2, roi, OErr,CErr):
+#omission/commission threshold images for one yearly watermask.
+#errors are indexed by 10 m distance bins (1-10) to the nearest land (omission)
+#or water (commission) pixel, capped at 90 m.
+def distanceThresholds(watermask, OErr, CErr):
   bins = ee.List.sequence(1,10,1) 
-
-  def addYearNoise(watermask):
-    def addObsNoise(num):
-      #create random noise image
-      noise = ee.Image.random(seed.add(num))
-      
-      WDist = watermask.cumulativeCost(watermask.Not(),90).mask(watermask)
-      WDist = WDist.add(WDist.eq(0).multiply(90))
-      WBinImage = WDist.divide(10).add(1).toInt8()
-      OThreshImg = WBinImage.remap(bins,OErr).unmask()
-      
-      LDist = watermask.Not().cumulativeCost(watermask,90).mask(watermask.Not())
-      LDist = LDist.add(LDist.eq(0).multiply(90))
-      LBinImage = LDist.divide(10).add(1).toInt8()
-      CThreshImg = LBinImage.remap(bins,CErr).unmask()
-      
-      noisyImg = (watermask
-      .subtract(noise.lte(OThreshImg)).eq(1) #remove some water
-      .add(noise.gte(ee.Image.constant(1).subtract(CThreshImg))).gte(1)) #add some water
   
-      return noisyImg
-    
-    seed = watermask.getNumber("system:time_start")
-    watermask = watermask.gte(2);
-    #duplicate the yearly map with new noise for each observation
-    monthMasks = ee.List.sequence(0,12).map(addObsNoise)
-    #aggregate to a yearly mask
-    yearMask = ee.ImageCollection(monthMasks).reduce(ee.Reducer.mean()).gte(0.5)
-    return yearMask
+  WDist = watermask.cumulativeCost(watermask.Not(),90).mask(watermask)
+  WDist = WDist.add(WDist.eq(0).multiply(90))
+  WBinImage = WDist.divide(10).add(1).toInt8()
+  OThreshImg = WBinImage.remap(bins,OErr).unmask()
   
-  yearMasks = jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year')).map(addYearNoise)
-  noisyMask = ee.ImageCollection(yearMasks).reduce(ee.Reducer.mean()).gte(0.5)
-  return noisyMask
-
-def addNoise_pickens(year1, year2, roi, OErr,CErr):
-  bins = ee.List.sequence(1,10,1) 
+  LDist = watermask.Not().cumulativeCost(watermask,90).mask(watermask.Not())
+  LDist = LDist.add(LDist.eq(0).multiply(90))
+  LBinImage = LDist.divide(10).add(1).toInt8()
+  CThreshImg = LBinImage.remap(bins,CErr).unmask()
+  
+  return OThreshImg, CThreshImg
 
-  def addYearNoise(watermask):
+#distance-dependent observation noise for yearly images in collection (water where >= waterThresh).
+#the distance transforms and thresholds only depend on the yearly mask, so they are
+#computed once per year and only the random draw changes between the nObs observations.
+def addNoise_distance(collection, waterThresh, year1, year2, OErr, CErr, nObs=13):
+  def addYearNoise(img):
+    seed = img.getNumber("system:time_start")
+    watermask = img.gte(waterThresh)
+    OThreshImg, CThreshImg = distanceThresholds(watermask, OErr, CErr)
+    CLimitImg = ee.Image.constant(1).subtract(CThreshImg)
+    
     def addObsNoise(num):
       #create random noise image
       noise = ee.Image.random(seed.add(num))
       
-      WDist = watermask.cumulativeCost(watermask.Not(),90).mask(watermask)
-      WDist = WDist.add(WDist.eq(0).multiply(90))
-      WBinImage = WDist.divide(10).add(1).toInt8()
-      OThreshImg = WBinImage.remap(bins,OErr).unmask()
-      
-      LDist = watermask.Not().cumulativeCost(watermask,90).mask(watermask.Not())
-      LDist = LDist.add(LDist.eq(0).multiply(90))
-      LBinImage = LDist.divide(10).add(1).toInt8()
-      CThreshImg = LBinImage.remap(bins,CErr).unmask()
-      
       noisyImg = (watermask
       .subtract(noise.lte(OThreshImg)).eq(1) #remove some water
-      .add(noise.gte(ee.Image.constant(1).subtract(CThreshImg))).gte(1)) #add some water
+      .add(noise.gte(CLimitImg)).gte(1)) #add some water
   
       return noisyImg
     
-    seed = watermask.getNumber("system:time_start")
-#    seed = ee.Number(42)
-    watermask = watermask.gte(50);
     #duplicate the yearly map with new noise for each observation
-    monthMasks = ee.List.sequence(0,12).map(addObsNoise)
+    monthMasks = ee.List.sequence(0,nObs-1).map(addObsNoise)
     #aggregate to a yearly mask
     yearMask = ee.ImageCollection(monthMasks).reduce(ee.Reducer.mean()).gte(0.5)
     return yearMask
   
-  yearMasks = pickensYearly.filter(ee.Filter.calendarRange(year1,year2,'year')).map(addYearNoise)
+  yearMasks = collection.filter(ee.Filter.calendarRange(year1,year2,'year')).map(addYearNoise)
   noisyMask = ee.ImageCollection(yearMasks).reduce(ee.Reducer.mean()).gte(0.5)
   return noisyMask
-                                   
+
+def addNoise_pekel_distance(year1, year2, roi, OErr,CErr):
+  return addNoise_distance(ctx.jrcYearly, 2, year1, year2, OErr, CErr)
+
+def addNoise_pickens(year1, year2, roi, OErr,CErr):
+  return addNoise_distance(ctx.pickensYearly, 50, year1, year2, OErr, CErr)
 
 
 
@@ -213,7 +214,7 @@ def addNoise_pickens(year1, year2, roi, OErr,CErr):
 def pekelMask(year1, year2, sword_clip):
   roi = sword_clip.get('roi')
   
-  watermask = (jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
+  watermask = (ctx.jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
                .map(lambda img: img.selfMask())
                .reduce(ee.Reducer.median())
                .clip(roi)
@@ -256,7 +257,7 @@ def pekelMask(year1, year2, sword_clip):
                 .rename("noisyRiverMask"))
 
   
-  noData = (jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
+  noData = (ctx.jrcYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
             .map(lambda img: img.eq(0))  #pixels with no data = 1 (collection)
             .reduce(ee.Reducer.mean()).gte(0.75)      #pixels with no data in most of the images
             .unmask()
@@ -276,7 +277,7 @@ def pekelMask(year1, year2, sword_clip):
 def pickensMask(year1, year2, sword_clip):
   roi = sword_clip.get('roi')
   
-  watermask = (pickensYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
+  watermask = (ctx.pickensYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
                .map(lambda img: img.unmask())
                .reduce(ee.Reducer.mean()).clip(roi).gte(50)
                .rename('watermask'))
@@ -307,7 +308,7 @@ def pickensMask(year1, year2, sword_clip):
              .focal_max().focal_min()
              .rename("noisyRiverMask"))
   
-  noData = (pickensYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
+  noData = (ctx.pickensYearly.filter(ee.Filter.calendarRange(year1,year2,'year'))
             .map(lambda img: img.gte(0).unmask().Not())
             .reduce(ee.Reducer.mean()).gte(0.75)
             .And(riverMask.Not()).rename("noData"))   #dont mask pixels that are water after closure
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local (NumPy) counterparts of the watermask functions
+
+Images are plain 2-D arrays on the ROI grid, row 0 is north. Masked pixels
+in float bands are NaN, the same way Earth Engine would leave them masked.
+Band stacks are returned as dicts keyed by the Earth Engine band names.
+
+"""
+import numpy as np
+
+#kernel weights shared with functions_watermask, which builds its ee.Kernels from these.
+daWeights = [[0.5,  0.5, 0.5],
+             [0.5,  -1,  0.5],
+             [0.5,  0.5, 0.5]]
+
+#kernel that gives unique value for each bank orientation in 3x3
+directionWeights = [[128,  1, 2],
+                    [ 64,  256, 4],
+                    [ 32, 16, 8]]
+
+#ee.Kernel.euclidean(1) in pixels: distance from the centre pixel.
+euclideanWeights = [[2**0.5, 1, 2**0.5],
+                    [1,      0, 1],
+                    [2**0.5, 1, 2**0.5]]
+
+#translate kernel values to angles. Found these using a MATLAB script.
+kernelValues = [1, 4, 16, 64, 129, 3, 6, 12, 24, 48, 96, 192, 131, 7, 14, 28, 56, 112, 224, 193, 135, 15, 30, 60, 120, 240, 225, 195, 143, 31, 62, 124, 248, 241, 227, 199, 159, 63, 126, 252, 249, 243, 231, 207]
+
+aspectKey = [4.712389, 0.000000, 1.570796, 3.141593, 4.467410, 4.957368, 6.038207, 0.244979, 1.325818, 1.815775, 2.896614, 3.386571, 4.712389, 5.497787, 0.000000, 0.785398, 1.570796, 2.356194, 3.141593, 3.926991, 5.092895, 5.902679, 0.380506, 1.190290, 1.951303, 2.761086, 3.522099, 4.331883, 5.497787, 0.000000, 0.785398, 1.570796, 2.356194, 3.141593, 3.926991, 4.712389, 5.695183, 0.588003, 0.982794, 2.158799, 2.553590, 3.729595, 4.124386, 5.300392]
+
+
+def _aspectLUT():
+  #direct lookup for every possible directionKernel sum (9 binary pixels -> 0..511).
+  #codes missing from kernelValues stay NaN, which is what remap leaves masked.
+  nCodes = int(np.sum(directionWeights)) + 1
+  if len(kernelValues) != len(aspectKey) or len(set(kernelValues)) != len(kernelValues):
+    raise ValueError("kernelValues and aspectKey do not describe a one-to-one remap")
+  if nCodes != 512 or max(kernelValues) >= 256:
+    #every bank code has a land centre pixel (weight 256 unset)
+    raise ValueError("kernelValues do not match directionWeights")
+  lut = np.full(nCodes, np.nan, dtype=np.float32)
+  lut[kernelValues] = aspectKey
+  return lut
+
+aspectLUT = _aspectLUT()
+
+
+#3x3 convolution (ee.Image.convolve orientation), pixels outside the array are `fill`.
+def convolve3x3(image, weights, fill=0):
+  H, W = image.shape
+  padded = np.pad(image, 1, mode='constant', constant_values=fill)
+  out = np.zeros((H, W), dtype=np.result_type(image.dtype, np.asarray(weights).dtype))
+  for i in range(3):
+    for j in range(3):
+      if weights[i][j] != 0:
+        out += weights[i][j] * padded[i:i+H, j:j+W]
+  return out
+
+
+#same band stack as functions_watermask.bankCalcs: mask, banks, bankAspect, bankCurv, bankLen.
+def bankCalcs(riverMask):
+  riverMask = np.asarray(riverMask)
+  mask = np.nan_to_num(riverMask).astype(bool)
+
+  #unique orientation code per 3x3 neighbourhood, then straight into the lookup table.
+  codes = convolve3x3(mask.astype(np.uint16), directionWeights)
+  bankAspect = aspectLUT[codes]
+  isBank = ~np.isnan(bankAspect)
+
+  banks = np.where(isBank, np.float32(1), np.float32(np.nan))
+
+  #masked neighbours contribute nothing, output keeps the centre pixel's mask.
+  bankCurv = convolve3x3(np.where(isBank, bankAspect, 0), daWeights).astype(np.float32)
+  bankCurv[~isBank] = np.nan
+
+  bankLen = convolve3x3(isBank.astype(np.float32), euclideanWeights).astype(np.float32)
+  bankLen[~isBank] = np.nan
+
+  return {'mask': riverMask,
+          'banks': banks,
+          'bankAspect': bankAspect,
+          'bankCurv': bankCurv,
+          'bankLen': bankLen}
+
+
+#ee.Image.focal_max()/focal_min() defaults: circle of radius 1 pixel, i.e. the centre and its 4 neighbours.
+#NaN pixels are ignored like masked pixels and only stay NaN if the whole neighbourhood is masked.
+def _focal(image, reduce, fill):
+  image = np.asarray(image, dtype=np.float32)
+  H, W = image.shape
+  padded = np.pad(image, 1, mode='constant', constant_values=np.nan)
+  stack = np.stack([padded[1:H+1, 1:W+1], padded[0:H, 1:W+1], padded[2:H+2, 1:W+1],
+                    padded[1:H+1, 0:W], padded[1:H+1, 2:W+2]])
+  allMasked = np.isnan(stack).all(axis=0)
+  out = reduce(np.where(np.isnan(stack), fill, stack), axis=0)
+  out[allMasked] = np.nan
+  return out
+
+def focalMax(image):
+  return _focal(image, np.max, -np.inf)
+
+def focalMin(image):
+  return _focal(image, np.min, np.inf)
+
+
+#like functions_watermask.largestBody: the largest 4-connected body of a mask, as a boolean image.
+#ties go to the body whose first pixel comes first in row order.
+def largestBody(image):
+  from scipy import ndimage
+
+  labels, n = ndimage.label(np.nan_to_num(np.asarray(image, dtype=np.float32)) > 0)
+  if n == 0:
+    return np.zeros(labels.shape, dtype=bool)
+  count = np.bincount(labels.ravel(), minlength=n+1)
+  count[0] = 0
+  return labels == np.argmax(count)
+
+
+#like functions_watermask.fillBars: land regions (4-connected) of at most a 25th of the
+#roi area become water. roi is a boolean image of the roi, the whole array by default.
+def fillBars(image, roi=None):
+  from scipy import ndimage
+
+  water = np.nan_to_num(np.asarray(image, dtype=np.float32)) > 0
+  roi = np.ones(water.shape, dtype=bool) if roi is None else np.asarray(roi, dtype=bool)
+  labels, n = ndimage.label(~water & roi)
+  areaMax = roi.sum() / 25     #in pixels, so the pixel size cancels
+
+  #all regions are sized in one bincount and filled with one lookup
+  isBar = np.bincount(labels.ravel(), minlength=n+1) <= areaMax
+  isBar[0] = False
+  return (water | isBar[labels]) & roi
+
+
+#omission/commission error rates per 10 m distance bin for the Pickens and Pekel masks (pickensMask/pekelMask)
+pickensOErr = [0.4, 0.2, 0.1, .08, .05, .03, .02, .02, .01, 0]
+pickensCErr = [0.2, 0.1, 0.5, .03, .02, .01, .005, 0, 0, 0]
+pekelOErr = [0.55, 0.3, 0.15, .1, .08, .05, .03, .02, .01, 0]
+pekelCErr = [0.15, 0.05, 0.3, .02, .01, .005, 0, 0, 0, 0]
+
+
+#distance (m, capped at 90) to bin 1-10 to error rate, 0 where there is no bin.
+def _binErrors(dist, errors):
+  dist = np.where(dist == 0, 90, dist)
+  with np.errstate(invalid='ignore'):
+    bins = np.where(np.isnan(dist), 0, dist // 10 + 1).astype(np.int64)
+  lut = np.zeros(12, dtype=np.float32)
+  lut[1:11] = errors
+  return lut[np.clip(bins, 0, 11)]
+
+#like functions_watermask.distanceThresholds for a boolean yearly watermask
+def distanceThresholds(watermask, OErr, CErr, scale=30):
+  import functions_migration_local as fml
+
+  water = np.asarray(watermask, dtype=bool)
+  WDist = fml.cumulativeCost(water.astype(np.float32), ~water, 90, scale)
+  WDist[~water] = np.nan
+  LDist = fml.cumulativeCost((~water).astype(np.float32), water, 90, scale)
+  LDist[water] = np.nan
+  return _binErrors(WDist, OErr), _binErrors(LDist, CErr)
+
+
+#like functions_watermask.addNoise_distance for a stack of boolean yearly watermasks (nYears, H, W).
+#thresholds are computed once per year and all nObs observations are drawn as one
+#(nObs, H, W) array. seeds holds one seed or np.random.Generator per year.
+def addNoise_distance(watermasks, OErr, CErr, seeds, nObs=13, scale=30):
+  yearMasks = []
+  for watermask, seed in zip(watermasks, seeds):
+    water = np.asarray(watermask, dtype=bool)
+    OThresh, CThresh = distanceThresholds(water, OErr, CErr, scale)
+    noise = np.random.default_rng(seed).random((nObs,) + water.shape, dtype=np.float32)
+
+    #remove some water, add some water
+    noisy = (water & (noise > OThresh)) | (noise >= 1 - CThresh)
+    yearMasks.append(noisy.mean(axis=0) >= 0.5)
+
+  return np.mean(yearMasks, axis=0) >= 0.5